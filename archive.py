@@ -0,0 +1,267 @@
+from codec import Codec
+import numpy as np
+import schema
+import json
+import os
+
+
+class Archive():
+    """ Archive is a compact columnar store of audited signals on disk, for
+    analysing long histories across many publishers without building lists
+    of Python strings.
+
+    An archive is a directory of flat little-endian column files, one value
+    per signal, plus meta.json:
+
+        timestamp.bin   int64   unix seconds
+        block.bin       int64   block number
+        address.bin     uint32  index into meta "addresses"
+        hash.bin        32 raw bytes of the tx hash
+        <field>.bin     uint8   per data.json field, index into that field's
+                                [code, label] pairs in meta "dictionary", or
+                                ABSENT for a field the signal's schema
+                                version didn't have
+
+    The dictionary is the data.json vocabulary in its order when the archive
+    was created, so the indexes are the same ones Codec.pack uses and the
+    archive is decodable without data.json. As the schema grows, appends
+    add new codes to the end of their field's pairs and new fields as new
+    columns (ABSENT for rows already written), so existing indexes never
+    change. meta "schemas" records how many fields each schema version has,
+    so records() can re-encode every row in its own version's form.
+
+    Columns are opened with numpy.memmap, so scan() only pages in what it
+    touches and filtering by publisher, instrument or time range never loads
+    the whole archive."""
+
+    META = "meta.json"
+    VERSION = 1
+
+    # Field column value for a field the signal's schema version lacks.
+    ABSENT = 0xFF
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, self.META)) as file:
+            self.meta = json.load(file)
+        if self.meta["version"] != self.VERSION:
+            raise Exception("Unsupported archive version " +
+                            str(self.meta["version"]) + ".")
+
+        self.fields = self.meta["fields"]
+        self.dictionary = self.meta["dictionary"]
+        self.addresses = self.meta["addresses"]
+        self.count = self.meta["count"]
+
+        self.columns = {
+            name: self.column(name, dtype) for name, dtype in
+            self.dtypes(self.fields).items()}
+
+    @staticmethod
+    def dtypes(fields):
+        """Return {column name: numpy dtype} for an archive of fields."""
+
+        dtypes = {
+            "timestamp": np.dtype("<i8"),
+            "block": np.dtype("<i8"),
+            "address": np.dtype("<u4"),
+            "hash": np.dtype(("u1", 32))}
+        dtypes.update((f, np.dtype("u1")) for f in fields)
+        return dtypes
+
+    def column(self, name, dtype):
+        """Return a read-only memmap of a column, or an empty array."""
+
+        if not self.count:
+            return np.empty((0,) + dtype.shape, dtype.base)
+        return np.memmap(os.path.join(self.path, name + ".bin"), dtype=dtype,
+                         mode="r", shape=(self.count,))
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def write(cls, path, data, signals):
+        """Append signal records (address, hash, block, timestamp, signal
+        tuples such as auditor Signal records or Store.records() rows) to the
+        archive at path, creating it if needed. Return the number written."""
+
+        registry = schema.registry(data)
+        codec = registry.latest
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, cls.META)
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+        else:
+            meta = {
+                "version": cls.VERSION,
+                "schema": codec.version,
+                "fields": [],
+                "dictionary": {},
+                "addresses": [],
+                "count": 0}
+        added = cls.extend(meta, registry)
+
+        index = {a: i for i, a in enumerate(meta["addresses"])}
+        positions = {
+            f: {label: i for i, (code, label) in enumerate(pairs)}
+            for f, pairs in meta["dictionary"].items()}
+        columns = {name: [] for name in cls.dtypes(meta["fields"])}
+        for address, txhash, block, timestamp, signal in signals:
+            address = address.lower()
+            if address not in index:
+                index[address] = len(meta["addresses"])
+                meta["addresses"].append(address)
+            columns["timestamp"].append(int(timestamp))
+            columns["block"].append(int(block))
+            columns["address"].append(index[address])
+            columns["hash"].append(bytes.fromhex(txhash[2:]))
+            labels = dict(zip(codec.fields, registry.decode(signal)))
+            for f in meta["fields"]:
+                label = labels.get(f)
+                columns[f].append(
+                    cls.ABSENT if label is None else positions[f][label])
+
+        written = len(columns["timestamp"])
+        for name, dtype in cls.dtypes(meta["fields"]).items():
+            column = os.path.join(path, name + ".bin")
+            if os.path.exists(column):
+                # Cut off anything a crashed append left past the count, so
+                # new rows line up with the rows meta.json knows about.
+                os.truncate(column, meta["count"] * dtype.itemsize)
+            if name in added:
+                # Rows written before the field existed don't have it.
+                with open(column, "wb") as file:
+                    file.write(bytes([cls.ABSENT]) * meta["count"])
+            with open(column, "ab") as file:
+                if name == "hash":
+                    file.write(b"".join(columns[name]))
+                else:
+                    file.write(np.array(columns[name], dtype=dtype).tobytes())
+
+        # Meta goes last, so a crash mid-append leaves the previous count
+        # and the partial rows are cut off by the next write.
+        meta["count"] += written
+        with open(meta_path + ".tmp", "w") as file:
+            json.dump(meta, file)
+        os.replace(meta_path + ".tmp", meta_path)
+        return written
+
+    @classmethod
+    def extend(cls, meta, registry):
+        """ Add the codes and fields registry has that archive meta doesn't
+        yet to meta, in place, and return the names of the fields added.
+        Raise an exception if registry gives a code already in the archive
+        a different label, or a field more values than fit beside ABSENT."""
+
+        schemas = meta.setdefault("schemas", {})
+        for version, codec in registry.codecs.items():
+            if schemas.setdefault(str(version), len(codec.fields)) != \
+                    len(codec.fields):
+                raise Exception("Archive was written with a different " +
+                                "data.json schema version " + str(version) +
+                                ".")
+        meta["schema"] = max(meta.get("schema", 0), registry.version)
+
+        added = []
+        for f, pairs in cls.dictionary(registry).items():
+            if f not in meta["dictionary"]:
+                meta["fields"].append(f)
+                meta["dictionary"][f] = []
+                added.append(f)
+            table = meta["dictionary"][f]
+            labels = dict(table)
+            for code, label in pairs:
+                if code not in labels:
+                    table.append([code, label])
+                elif labels[code] != label:
+                    raise Exception("Archive was written with a different " +
+                                    "label for code " + code + " of field " +
+                                    f + ".")
+            if len(table) >= cls.ABSENT:
+                raise Exception("Too many values in field " + f +
+                                " to archive.")
+        return added
+
+    @staticmethod
+    def dictionary(data):
+        """Return {field: [[code, label], ...]} in data.json order."""
+
+        return {f: [list(item) for item in values.items()]
+                for f, values in schema.registry(data).vocabulary.items()}
+
+    def mask(self, start, stop, address=None, start_time=None, end_time=None,
+             **fields):
+        """Return a boolean mask over rows start:stop matching the filters:
+        publisher address, unix time range [start_time, end_time) and field
+        labels given by field name (e.g. instrument="BTCUSD")."""
+
+        mask = np.ones(stop - start, dtype=bool)
+        if address is not None:
+            try:
+                i = self.addresses.index(address.lower())
+            except ValueError:
+                return mask & False
+            mask &= self.columns["address"][start:stop] == i
+        times = self.columns["timestamp"][start:stop]
+        if start_time is not None:
+            mask &= times >= start_time
+        if end_time is not None:
+            mask &= times < end_time
+        for f, label in fields.items():
+            labels = [item[1] for item in self.dictionary[f]]
+            if label not in labels:
+                return mask & False
+            mask &= self.columns[f][start:stop] == labels.index(label)
+        return mask
+
+    def scan(self, chunk: int = 1 << 20, **filters):
+        """Yield {column: array} dicts of matching rows, chunk rows of the
+        archive at a time. See mask() for filters."""
+
+        for start in range(0, self.count, chunk):
+            stop = min(start + chunk, self.count)
+            mask = self.mask(start, stop, **filters)
+            if mask.any():
+                yield {name: np.asarray(col[start:stop][mask])
+                       for name, col in self.columns.items()}
+
+    def select(self, **filters):
+        """Return all matching rows as one {column: array} dict."""
+
+        parts = list(self.scan(**filters))
+        if not parts:
+            return {name: np.empty((0,) + col.shape[1:], col.dtype)
+                    for name, col in self.columns.items()}
+        return {name: np.concatenate([p[name] for p in parts])
+                for name in self.columns}
+
+    def records(self, rows):
+        """Return (address, hash, block, timestamp, signal) tuples for a
+        select()/scan() result, with each signal in encode() form for the
+        latest schema version with the fields it has."""
+
+        # Latest version with each field count; older archives only know
+        # the one version they were written with.
+        versions = {}
+        for version, count in sorted(
+                self.meta.get("schemas", {}).items(), key=lambda v: int(v[0])):
+            versions[count] = int(version)
+        versions.setdefault(len(self.fields), self.meta.get("schema", 0))
+
+        result = []
+        for i, (a, h, b, t) in enumerate(zip(
+                rows["address"], rows["hash"], rows["block"],
+                rows["timestamp"])):
+            codes = []
+            for f in self.fields:
+                if rows[f][i] == self.ABSENT:
+                    break
+                codes.append(self.dictionary[f][rows[f][i]][0])
+            version = versions[len(codes)]
+            result.append((
+                self.addresses[a], "0x" + h.tobytes().hex(), int(b), int(t),
+                Codec.HEADER + (str(version) if version else "") +
+                "".join(codes)))
+        return result
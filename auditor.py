@@ -1,76 +1,370 @@
-from web3 import Web3
 from datetime import datetime
-import requests
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from backends import EtherscanBackend
+from cache import SignalCache
+import metrics as _metrics
+from codec import Codec
+import merkle
+import schema
+from store import Store
+from transport import Transport
 import json
 
+# A signal scraped from chain: originating address, tx hash, block number,
+# unix timestamp and the Publisher-encoded signal string.
+Signal = namedtuple("Signal", "address hash block timestamp payload")
+
 
 class Auditor():
     """ Auditor provides functionality to scrape a given ETH address for
     transaction data matching Publisher signal formatting, as well as parsing
     and displaying the signals in a human-readable format."""
 
-    def __init__(self, endpoint, data, etherscan_api_token, live: bool):
+    def __init__(self, endpoint, data, etherscan_api_token, live: bool,
+                 store=None, transport=None, backend=None, cache=None,
+                 metrics=None, index=None):
         self.endpoint = endpoint
         self.data = data
         self.token = etherscan_api_token
         self.live = live
 
-        # Connect to ETH node.
-        self.w3 = Web3(Web3.HTTPProvider(self.endpoint))
+        # Timings and counters; disabled unless a metrics.Metrics is given.
+        self.metrics = metrics if metrics is not None else _metrics.NULL
+
+        # Lookup tables for decoding signals of every schema version,
+        # compiled once from data (a schema.Registry or data.json document).
+        self.codec = schema.registry(self.data)
+
+        # Local signal store and scan checkpoints. Defaults to an in-memory
+        # store, pass a file-backed Store to keep history between sessions.
+        self.store = store if store is not None else Store()
+
+        # Pooled, rate limited HTTP session shared by all scrapes.
+        self.transport = transport if transport is not None else Transport(
+            metrics=self.metrics)
+
+        # Where transactions are scraped from; etherscan by default, or pass
+        # a backends.NodeBackend to scan blocks from our own node.
+        self.backend = backend if backend is not None else EtherscanBackend(
+            self.token, self.live, self.transport)
+
+        # Cache of audit() results, revalidated against the backend's latest
+        # block for the address once older than its TTL.
+        self.cache = cache if cache is not None else SignalCache(
+            metrics=self.metrics)
+
+        # Optional index.Index that every stored signal is also added to,
+        # for querying across publishers.
+        self.index = index
+
+        # ETH node connection, opened on first use of self.w3 so importing
+        # and constructing this class doesn't pull in web3.
+        self._w3 = None
+
+    @property
+    def w3(self):
+        """Web3 connection to the ETH node."""
+
+        if self._w3 is None:
+            from web3 import Web3
+            self._w3 = Web3(Web3.HTTPProvider(
+                self.endpoint,
+                request_kwargs={"timeout": self.transport.timeout}))
+        return self._w3
 
     def scrape(self, address):
         """ Return a list of Publisher-formattted signal strings scraped from
         the given Ethereum address. If the address's transactions contain no
         signal strings, return False.
 
-        We use the etherscan API to grab all transactions for an address as the
-        web3 python API lacks this capability - you'd have to manually parse
-        all previous blocks data to do this with web3, very slow."""
+        By default we use the etherscan API to grab all transactions for an
+        address as the web3 python API lacks this capability - you'd have to
+        manually parse all previous blocks data to do this with web3, which is
+        what backends.NodeBackend does, in parallel batches.
 
-        if self.live:
-            baseurl = "api"
-        else:
-            baseurl = "api-ropsten"
-
-        payload = str(
-            "http://" + baseurl + ".etherscan.io/api?module=account&action=" +
-            "txlist&address=" + address + "&startblock=0&endblock=99999999&" +
-            "sort=asc&apikey=" + self.token)
-
-        # Disguide our request as a browser, so etherscan doesnt block it.
-        # Sometimes servers block non=browser traffic
-        headers = {
-            'Accept': "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3",  # noqa
-            'Accept-Encoding': "gzip, deflate",
-            'Accept-Language': "en-US,en;q=0.9",
-            'Cache-Control': "max-age=0",
-            'Connection': "keep=alive",
-            'Host': 'api-ropsten.etherscan.io',
-            'Upgrade-Insecure-Requests': '1',
-            'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"}  # noqa
-
-        # Get all transactions pertaining to the specified address
-        response = requests.get(payload, headers=headers).json()
-
-        # Strip transaction msg payloads, converting from hex string to bytes.
-        result = [
-            {i['timeStamp']: bytes.fromhex(
-                i['input'][2:]).decode()} for i in response['result'] if self.verify(i, address)]  # noqa
-
-        # Remove duplicates by converting list to set and back; return the list
-        return [dict(t) for t in {tuple(d.items()) for d in result}]
+        Only blocks after the address's store checkpoint are fetched; new
+        signals are merged into the store and the full history is returned.
+        Transactions with signals in a schema version newer than the schema
+        file can't be read yet; they are kept in the store and read by a
+        later scrape once the file has been updated (see recheck())."""
+
+        checkpoint = self.store.checkpoint(address)
+        startblock = 0 if checkpoint is None else checkpoint + 1
+
+        with self.metrics.span("scrape", address=address.lower()):
+            self.recheck(address)
+            for txs, block in self.backend.pages(address, startblock):
+                # Merge each page into the store (which drops duplicates) and
+                # advance the checkpoint to the highest block the backend has
+                # fully covered, signal or not.
+                signals = self.signals(txs, address)
+                commitments = self.commitments(txs, address)
+                unknown = self.unknown(txs, address)
+                self.merge(address, signals, block, commitments, unknown)
+
+        return self.store.signals(address)
+
+    def recheck(self, address):
+        """Read the transactions kept for address because their schema
+        version was unknown, merging the signals of those we can now read.
+        Return the Signal records found."""
+
+        txs = self.store.unknown(address)
+        if not txs:
+            return []
+        still = {tx['hash'] for tx in self.unknown(txs, address)}
+        readable = [tx for tx in txs if tx['hash'] not in still]
+        if not readable:
+            return []
+        signals = self.signals(readable, address)
+        self.store.resolve(address, signals, [tx['hash'] for tx in readable])
+        if self.index is not None and signals:
+            self.index.add(signals)
+        return signals
+
+    def merge(self, address, signals, block, commitments=(), unknown=()):
+        """Merge signal and commitment records (and unreadable transactions)
+        for address into the store, advancing its checkpoint to block (see
+        Store.merge), and add the signals to the index, if any."""
+
+        with self.metrics.span("store_merge"):
+            self.store.merge(address, signals, block, commitments, unknown)
+        if self.index is not None and (signals or commitments):
+            with self.metrics.span("index_add"):
+                self.index.add(signals)
+                self.index.add_roots(commitments)
+
+    def scrape_many(self, addresses, workers: int = 8):
+        """Scrape each of the given addresses concurrently, yielding
+        (address, signals) tuples in completion order, where signals is the
+        scrape() result for that address, or the exception raised if its
+        scrape failed.
+
+        Requests from all workers share the transport's connection pool and
+        rate limiter, so raising workers beyond the etherscan quota only
+        hides latency rather than getting us throttled."""
+
+        return self.each(self.scrape, addresses, workers)
+
+    def audit(self, address):
+        """ Return [signals, decoded] for address, where signals is the
+        scrape() result and decoded the decode() result, served from the
+        cache when possible.
+
+        A cached result younger than the cache TTL costs no requests at all;
+        an older one costs a single head check, and is only re-scraped and
+        re-decoded if the address has a newer transaction."""
+
+        def compute():
+            signals = self.scrape(address)
+            return [signals, self.decode(signals)]
+
+        return self.cache.fetch(
+            address, lambda: self.backend.latest(address), compute)
+
+    def audit_many(self, addresses, workers: int = 8):
+        """As scrape_many(), but yielding (address, audit() result)."""
+
+        return self.each(self.audit, addresses, workers)
+
+    def each(self, method, addresses, workers):
+        """Yield (address, method(address)) for each of addresses, run on a
+        thread pool, in completion order. If method raises for an address,
+        the exception is yielded in place of its result, so one bad address
+        doesn't throw away the rest of a sweep."""
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(method, a): a for a in addresses}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+                yield futures[future], result
+
+    def scrape_pages(self, address, startblock=0):
+        """Yield lists of verified Signal records from the given address's
+        transactions, one list per page fetched by the backend, so callers can
+        decode and display signals before the whole history has arrived. The
+        store is not touched."""
+
+        for txs in self.txlist(address, startblock):
+            yield self.signals(txs, address)
+
+    def txlist(self, address, startblock=0):
+        """Yield non-empty pages of raw etherscan-style transaction dicts for
+        address from the backend, in ascending block order, starting from
+        startblock."""
+
+        for txs, block in self.backend.pages(address, startblock):
+            if txs:
+                yield txs
+
+    def signals(self, txs, address):
+        """Return Signal records for the transactions in txs that verify as
+        Publisher signals sent from address."""
+
+        # lowercase address param as web3 returns lowercase addresses
+        address = address.lower()
+        result = []
+        with self.metrics.span("verify"):
+            for i in txs:
+                for timestamp, payload in self.payloads(i, address):
+                    result.append(Signal(
+                        address, i['hash'], int(i['blockNumber']),
+                        timestamp, payload))
+        self.metrics.count("txs_scanned", len(txs))
+        self.metrics.count("signals_matched", len(result), address=address)
+        return result
+
+    # Hex encodings of the "SAE" publisher header and batch and commitment
+    # payload headers, as they appear at the start of a signal tx's input
+    # field, and the input length of a commitment.
+    HEADER = "0x534145"
+    BATCH_HEADERS = (
+        "0x" + Codec.BATCH_HEADER.hex(),
+        "0x" + Codec.VERSIONED_BATCH_HEADER.hex())
+    COMMIT_HEADER = "0x" + merkle.COMMIT_HEADER.hex()
+    COMMIT_HEX_LEN = 2 + merkle.COMMIT_LEN * 2
+
+    def payloads(self, tx, address):
+        """scrape() helper function. Return a list of (timestamp, signal
+        string) tuples from the given tx if its message begins with publisher
+        header "SAE" and originated from address parameter (lowercase),
+        otherwise an empty list.
+
+        The message is either a single signal that is well-formed for its
+        schema version (right length, known codes) or a batch payload (see
+        Codec.pack) whose signals are returned in single signal form. Either
+        way signals are stamped with the tx timestamp: a batch's per-signal
+        offsets are chosen by the publisher, so the times they claim (see
+        Codec.unpack) could backdate a signal by up to Codec.MAX_OFFSET
+        seconds and aren't trusted.
+
+        The cheap checks run on the raw hex string first, so the payload is
+        only decoded for transactions that look like signals. Payloads that
+        are not valid UTF-8 or malformed batches are skipped rather than
+        raising."""
+
+        data = tx['input']
+        if not data.startswith(self.HEADER) or tx['from'] != address:
+            return []
+        try:
+            if data.startswith(self.BATCH_HEADERS):
+                timestamp = int(tx['timeStamp'])
+                return [(timestamp, signal) for offset, signal in
+                        self.codec.unpack(bytes.fromhex(data[2:]))]
+            signal = bytes.fromhex(data[2:]).decode()
+            if self.codec.matches(signal):
+                return [(int(tx['timeStamp']), signal)]
+        except (ValueError, UnicodeDecodeError):
+            pass
+        return []
+
+    def unknown(self, txs, address):
+        """Return the transactions in txs carrying signals from address in a
+        schema version we don't know (see schema.Registry.unknown)."""
+
+        address = address.lower()
+        result = []
+        for i in txs:
+            if not i['input'].startswith(self.HEADER) or \
+                    i['from'] != address:
+                continue
+            try:
+                if self.codec.unknown(bytes.fromhex(i['input'][2:18])):
+                    result.append(i)
+            except ValueError:
+                continue
+        return result
+
+    def commitments(self, txs, address):
+        """Return merkle.Commitment records for the Merkle roots published
+        in txs by address."""
+
+        address = address.lower()
+        result = []
+        for i in txs:
+            if len(i['input']) != self.COMMIT_HEX_LEN or \
+                    not i['input'].startswith(self.COMMIT_HEADER) or \
+                    i['from'] != address:
+                continue
+            try:
+                root, count = merkle.parse(bytes.fromhex(i['input'][2:]))
+            except ValueError:
+                continue
+            result.append(merkle.Commitment(
+                address, i['hash'], int(i['blockNumber']),
+                int(i['timeStamp']), root.hex(), count))
+        return result
+
+    def prove(self, address, proof: dict):
+        """ Return the Signal record a merkle.ProofIndex proof establishes
+        for address, or None if it doesn't check out. The proof must lead
+        from the signal's leaf to a root address published, and the signal
+        must be well-formed and stamped no later than the root's transaction
+        and no more than merkle.MAX_AGE seconds before it.
+
+        The publisher chooses the stamp in the proof, so it could backdate a
+        signal by up to MAX_AGE. The record is therefore stamped with the
+        root's transaction time, by which the signal provably existed; the
+        claimed time stays in the proof (and the publisher's index).
+
+        The address is only re-scraped if the root isn't in the store yet.
+        Proven signals are merged into the store, so later audits of the
+        address include them, and their leaves are counted against the
+        root's committed signals (see roots())."""
+
+        try:
+            root = bytes.fromhex(proof['root'])
+            timestamp = int(proof['timestamp'])
+            leaf = merkle.leaf(
+                bytes.fromhex(proof['salt']), timestamp, proof['signal'])
+            found = merkle.verify(root, leaf, proof['path'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        if not found or not self.codec.matches(proof['signal']):
+            return None
+
+        commitment = self.store.commitment(address, root.hex())
+        if commitment is None:
+            self.scrape(address)
+            commitment = self.store.commitment(address, root.hex())
+            if commitment is None:
+                return None
+        if not (commitment.timestamp - merkle.MAX_AGE <= timestamp <=
+                commitment.timestamp):
+            return None
+
+        signal = Signal(address.lower(), commitment.hash, commitment.block,
+                        commitment.timestamp, proof['signal'])
+        self.store.prove(address, signal, root.hex(), leaf.hex())
+        if self.index is not None:
+            self.index.add([signal])
+            self.index.prove(address, root.hex(), leaf.hex())
+        self.cache.invalidate(address)
+        return signal
+
+    def roots(self, address):
+        """ Return the Merkle roots address has published, as Store.roots()
+        dicts counting the signals committed under each and the ones proven
+        so far.
+
+        A commitment only shows the signals its publisher chooses to reveal,
+        so a publisher could commit both sides of a trade and prove the
+        winner; roots with fewer proven than committed have withheld
+        signals and should be flagged or penalized when scoring (see
+        scoring.Scorer.rank)."""
+
+        return self.store.roots(address)
 
     def verify(self, tx, address):
-        """scrape() helper function. Return true if the given tx message begins
-        with publisher header "SAE", is len(11), and originated from address
-        parameter."""
+        """Return true if the given tx message begins with publisher header
+        "SAE", is either a single signal or a batch payload, and originated
+        from address parameter."""
 
-        if(
-            (bytes.fromhex(tx['input'][2:]).decode()[:3] == "SAE") and
-                # lowercase address param as web3 returns lowercase addresses
-                (tx['from'] == address.lower()) and (
-                    len(bytes.fromhex(tx['input'][2:]).decode()) == 11)):
-            return True
+        return bool(self.payloads(tx, address.lower()))
 
     def validate(self, param):
         """Return True if param is either an address or private key."""
@@ -89,21 +383,13 @@ class Auditor():
         """Return a list of human-readable signal strings, given a list of
         Publisher-encoded signal dicts."""
 
-        decoded = []
-        if signals:
-            for sig in signals:
-                for key, val in sig.items():
-                    time = datetime.utcfromtimestamp(int(key))
-                    decoded.append([
-                            time.strftime("%H:%M:%S%z %d-%m-%Y"),
-                            self.data['data']['instrument'][val[3]],
-                            self.data['data']['inst_type'][val[4]],
-                            self.data['data']['exchange'][val[5]],
-                            self.data['data']['strategy'][val[6]],
-                            self.data['data']['direction'][val[7]],
-                            self.data['data']['order_type'][val[8]],
-                            self.data['data']['misc'][val[9]],
-                            self.data['data']['trigger'][val[10]]])
-            return decoded
-        else:
+        if not signals:
             return None
+
+        with self.metrics.span("decode"):
+            pairs = [(key, val) for sig in signals for key, val in sig.items()]
+            rows = self.codec.decode_batch([val for key, val in pairs])
+            return [
+                [datetime.utcfromtimestamp(int(key)).strftime(
+                    "%H:%M:%S%z %d-%m-%Y")] + row
+                for (key, val), row in zip(pairs, rows)]
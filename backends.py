@@ -0,0 +1,276 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from transport import Transport, TransportError, Retryable
+import json
+
+
+class EtherscanBackend():
+    """ Scraper backend that lists an address's transactions through the
+    etherscan API. The web3 API can't list transactions by address, so this
+    is the cheap way to audit an address that has no local node to scan.
+
+    Backends yield (txs, block) pages, where txs is a list of etherscan-style
+    transaction dicts (hash, blockNumber, timeStamp, from, input) in
+    ascending block order and block is the highest block the pages so far
+    fully cover, which is safe to checkpoint.
+
+    `token` may be a list of API keys; each call is then made with any of
+    them, rotating on retries (or hedged across them, if the transport
+    hedges) so one key's rate limit doesn't stall a scrape."""
+
+    # Transactions per Etherscan txlist call. Etherscan caps page * offset
+    # at 10000 results per query, so we page through history in block-range
+    # windows rather than by page number.
+    PAGE_SIZE = 1000
+
+    # Disguide our request as a browser, so etherscan doesnt block it.
+    # Sometimes servers block non=browser traffic
+    HEADERS = {
+        'Accept': "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3",  # noqa
+        'Accept-Encoding': "gzip, deflate",
+        'Accept-Language': "en-US,en;q=0.9",
+        'Cache-Control': "max-age=0",
+        'Connection': "keep=alive",
+        'Host': 'api-ropsten.etherscan.io',
+        'Upgrade-Insecure-Requests': '1',
+        'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"}  # noqa
+
+    def __init__(self, token, live: bool, transport=None, url=None):
+        self.token = token
+        self.live = live
+        self.transport = transport if transport is not None else Transport()
+
+        # API root; override to point at a mirror or a local stub server.
+        if url is None:
+            if self.live:
+                baseurl = "api"
+            else:
+                baseurl = "api-ropsten"
+            url = "http://" + baseurl + ".etherscan.io/api"
+        self.url = url
+
+    def latest(self, address):
+        """Return the block of address's latest transaction, or None if it
+        has none. Costs a single one-result txlist call."""
+
+        payload = str(
+            self.url + "?module=account&action=txlist&address=" + address +
+            "&startblock=0&endblock=99999999&page=1&offset=1&sort=desc" +
+            "&apikey=")
+        result = self.get(payload)['result']
+        return int(result[0]['blockNumber']) if result else None
+
+    def get(self, query):
+        """Make an API call, query being a URL ending in "apikey=". Returns
+        the decoded response."""
+
+        tokens = [self.token] if isinstance(self.token, str) else self.token
+        return self.transport.get(
+            [query + t for t in tokens], check=self.check,
+            headers=self.HEADERS)
+
+    @staticmethod
+    def check(response):
+        """Reject etherscan error responses, which come back as HTTP 200
+        with status "0" and a message string in place of the result."""
+
+        if response.get('status') == "0" and isinstance(
+                response.get('result'), str):
+            if "rate limit" in response['result'].lower():
+                raise Retryable(response['result'])
+            raise TransportError(response['result'])
+
+    def pages(self, address, startblock=0):
+        """Yield (txs, block) pages of all transactions for address from
+        startblock onwards.
+
+        Each page starts at the last block of the previous page, as a page can
+        end part way through a block; transactions already yielded from that
+        block are skipped. Only one page is held in memory at a time."""
+
+        page = 1
+        seen = set()
+        while True:
+            payload = str(
+                self.url + "?module=account&action=txlist&address=" +
+                address + "&startblock=" + str(startblock) +
+                "&endblock=99999999&page=" + str(page) + "&offset=" +
+                str(self.PAGE_SIZE) + "&sort=asc&apikey=")
+
+            response = self.get(payload)
+            result = response['result']
+            txs = [i for i in result if i['hash'] not in seen]
+            if not result:
+                return
+
+            # A full page may have cut its last block short, so only cover up
+            # to the block before it until the final page is in.
+            last = int(result[-1]['blockNumber'])
+            if len(result) < self.PAGE_SIZE:
+                yield txs, last
+                return
+            yield txs, last - 1
+
+            # Carry on from the last block of this page. If the whole page
+            # was that one block, step to the next page of it instead.
+            if last == startblock:
+                page += 1
+            else:
+                startblock, page, seen = last, 1, set()
+            seen.update(i['hash'] for i in result
+                        if int(i['blockNumber']) == last)
+
+
+class NodeBackend():
+    """ Scraper backend that scans blocks straight from an Ethereum node over
+    JSON-RPC, so audit throughput scales with our own node rather than a
+    third-party quota.
+
+    Blocks are fetched with full transactions in batched eth_getBlockByNumber
+    calls of `batch` blocks each, with up to `workers` batches in flight.
+    `endpoint` may be a list of equivalent node URLs to fail over or hedge
+    between. Pass a transport (anything with Transport.rpc_batch) to run
+    against a local dev chain or a recorded-RPC stand-in such as Replay.
+
+    A scan never starts before `startblock`, so the first scrape of an
+    address (with no checkpoint yet) doesn't walk the chain from genesis;
+    set it to the block publishing started at."""
+
+    def __init__(self, endpoint, transport=None, batch: int = 50,
+                 workers: int = 4, metrics=None, startblock: int = 0):
+        self.endpoint = endpoint
+        self.transport = (
+            transport if transport is not None
+            else Transport(rate=None, metrics=metrics))
+        self.batch = batch
+        self.workers = workers
+        self.startblock = startblock
+
+    # Hex encoding of the "SAE" publisher header; see Auditor.payloads.
+    HEADER = "0x534145"
+
+    def head(self):
+        """Return the node's latest block number."""
+
+        return int(self.rpc([("eth_blockNumber", [])])[0], 16)
+
+    def latest(self, address):
+        """Return the latest block that could hold a transaction from
+        address; for a node that's simply its head."""
+
+        return self.head()
+
+    def pages(self, address, startblock=0, endblock=None):
+        """Yield (txs, block) pages of transactions sent from address that
+        carry the "SAE" header, one page per batch of blocks scanned from
+        startblock (or the backend's startblock, if later) to endblock
+        (default: the node's head at call time)."""
+
+        address = address.lower()
+        startblock = max(startblock, self.startblock)
+        for blocks in self.blocks(startblock, endblock):
+            if not blocks:
+                continue
+            txs = [tx for b in blocks for tx in self.match(b, {address})]
+            yield txs, int(blocks[-1]['number'], 16)
+
+    def blocks(self, startblock, endblock=None):
+        """Yield lists of full blocks, in ascending order, for the range
+        startblock to endblock inclusive. Batches are fetched concurrently
+        but yielded in order, with a bounded number in flight."""
+
+        if endblock is None:
+            endblock = self.head()
+
+        ranges = (
+            range(i, min(i + self.batch, endblock + 1))
+            for i in range(startblock, endblock + 1, self.batch))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            inflight = deque()
+            for r in ranges:
+                inflight.append(pool.submit(self.fetch, r))
+                if len(inflight) >= self.workers * 2:
+                    yield inflight.popleft().result()
+            while inflight:
+                yield inflight.popleft().result()
+
+    def fetch(self, numbers):
+        """Return the full blocks for the given block numbers, fetched in one
+        batched RPC call. Blocks the node doesn't have yet are left out."""
+
+        blocks = self.rpc([
+            ("eth_getBlockByNumber", [hex(n), True]) for n in numbers])
+        return [b for b in blocks if b is not None]
+
+    def match(self, block, addresses):
+        """Return etherscan-style dicts for the transactions in block that
+        were sent from one of addresses (lowercase) and carry the "SAE"
+        header."""
+
+        result = []
+        for tx in block['transactions']:
+            sender = (tx.get('from') or "").lower()
+            if sender in addresses and tx['input'].startswith(self.HEADER):
+                result.append({
+                    'hash': tx['hash'],
+                    'blockNumber': str(int(block['number'], 16)),
+                    'timeStamp': str(int(block['timestamp'], 16)),
+                    'from': sender,
+                    'to': (tx.get('to') or "").lower(),
+                    'input': tx['input']})
+        return result
+
+    def rpc(self, calls: list):
+        """Run (method, params) calls against the node in one batch."""
+
+        return self.transport.rpc_batch(self.endpoint, calls)
+
+
+class Replay():
+    """ Recorded-RPC stand-in for a NodeBackend transport, answering
+    rpc_batch calls from a recording instead of a node, so scans can be
+    tested and benchmarked offline.
+
+    A recording maps json.dumps([method, params]) to the call's result, and
+    is given as a dict (or anything with __getitem__) or the path of a JSON
+    file holding one. Record one from a live node by passing record=transport;
+    every call is then forwarded to it and its results kept for save().
+
+        replay = Replay({}, record=Transport(rate=None))
+        NodeBackend(url, replay, startblock=n).pages(address)
+        replay.save("rpc.json")
+        NodeBackend(url, Replay("rpc.json"), startblock=n).pages(address)"""
+
+    def __init__(self, recording, record=None):
+        if isinstance(recording, str):
+            with open(recording) as file:
+                recording = json.load(file)
+        self.recording = recording
+        self.record = record
+
+    @staticmethod
+    def key(method, params):
+        """Return the recording key of a call."""
+
+        return json.dumps([method, params])
+
+    def rpc_batch(self, url, calls: list):
+        """As Transport.rpc_batch. Raise TransportError for a call that
+        wasn't recorded, unless recording."""
+
+        if self.record is not None:
+            results = self.record.rpc_batch(url, calls)
+            for (method, params), result in zip(calls, results):
+                self.recording[self.key(method, params)] = result
+            return results
+        try:
+            return [self.recording[self.key(method, params)]
+                    for method, params in calls]
+        except KeyError as e:
+            raise TransportError("No recorded result for call:", str(e))
+
+    def save(self, path):
+        """Write the recording to a JSON file."""
+
+        with open(path, "w") as file:
+            json.dump(dict(self.recording), file)
@@ -0,0 +1,149 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from auditor import Auditor, Signal
+from merkle import Commitment
+import os
+
+# Per-process auditor used by worker processes, set up by init_worker().
+worker = None
+
+
+def init_worker(data):
+    """Process pool initializer: build the worker's auditor once."""
+
+    global worker
+    worker = Auditor("", data, "", False)
+
+
+def verify_page(txs, address):
+    """ Worker task: verify and decode one raw transaction page. Returns
+    (signals, rows, commitments, unknown), signals as plain (address, hash,
+    block, timestamp, payload) tuples, rows their Auditor.decode() rows,
+    commitments any Merkle roots published as plain tuples, which pickle
+    far smaller than the page itself, and unknown the Auditor.unknown()
+    transactions."""
+
+    signals = worker.signals(txs, address)
+    commitments = [tuple(c) for c in worker.commitments(txs, address)]
+    unknown = worker.unknown(txs, address)
+    if not signals:
+        return [], [], commitments, unknown
+    rows = worker.decode([{str(s.timestamp): s.payload} for s in signals])
+    return [tuple(s) for s in signals], rows, commitments, unknown
+
+
+class Backfill():
+    """ Bulk mode for backfilling new publishers or re-verifying whole
+    histories, where the CPU-bound work (hex decoding, header checks,
+    unpacking batches and formatting decoded rows) outgrows one thread.
+
+    Pages are fetched by the auditor's backend as usual and screened in this
+    process on the cheap raw hex checks (sender and "SAE" header), then the
+    candidate transactions of each page are verified and decoded in a pool
+    of `processes` worker processes (default: one per core), with up to
+    `inflight` pages per process queued. Shipping only candidates keeps
+    pickling the pages from becoming the bottleneck.
+    Results are merged back in page order, dropping transactions already
+    merged from an earlier page, and written to the auditor's store with the
+    same checkpoints scrape() uses, so later audits carry on incrementally.
+
+        with Backfill(auditor) as backfill:
+            for address, found in backfill.run(addresses):
+                ..."""
+
+    def __init__(self, auditor, processes=None, inflight: int = 2):
+        self.auditor = auditor
+        self.processes = processes or os.cpu_count() or 1
+        self.inflight = inflight
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def start(self):
+        """Start the worker processes, if not already running."""
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.processes, initializer=init_worker,
+                initargs=(self.auditor.codec.path or
+                          self.auditor.codec.document,))
+        return self.pool
+
+    def close(self):
+        """Shut the worker processes down."""
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def run(self, addresses, workers: int = 8, startblock=None):
+        """Backfill each of addresses, fetching up to workers addresses
+        concurrently, and yield (address, scrape() result) tuples in
+        completion order, with the exception raised in place of the result
+        for addresses that failed."""
+
+        self.start()
+        return self.auditor.each(
+            lambda a: self.scrape(a, startblock), addresses, workers)
+
+    def scrape(self, address, startblock=None):
+        """ Backfill address from startblock, by default the block after its
+        store checkpoint (pass 0 to re-verify its whole history). Return the
+        (Signal, decoded row) pairs found, in chain order."""
+
+        if startblock is None:
+            checkpoint = self.auditor.store.checkpoint(address)
+            startblock = 0 if checkpoint is None else checkpoint + 1
+
+        with self.auditor.metrics.span("backfill", address=address.lower()):
+            self.auditor.recheck(address)
+            found = self.process(
+                address, self.auditor.backend.pages(address, startblock))
+        self.auditor.cache.invalidate(address)
+        return found
+
+    def process(self, address, pages):
+        """ Verify and decode (txs, block) pages, such as a backend's pages(),
+        across the worker processes, merging each page into the store in
+        order. Return the (Signal, decoded row) pairs found."""
+
+        pool = self.start()
+        address = address.lower()
+        found = []
+        seen = set()
+        pending = deque()
+
+        def merge(future, block):
+            signals, rows, commitments, unknown = future.result()
+            hashes = set()
+            kept = []
+            for signal, row in zip(signals, rows):
+                if signal[1] in seen:
+                    continue
+                hashes.add(signal[1])
+                kept.append((Signal(*signal), row))
+            seen.update(hashes)
+            self.auditor.metrics.count(
+                "signals_matched", len(kept), address=address)
+            self.auditor.merge(
+                address, [s for s, row in kept], block,
+                [Commitment(*c) for c in commitments], unknown)
+            found.extend(kept)
+
+        header = self.auditor.HEADER
+        for txs, block in pages:
+            self.auditor.metrics.count("txs_scanned", len(txs))
+            candidates = [tx for tx in txs if tx['from'] == address and
+                          tx['input'].startswith(header)]
+            pending.append(
+                (pool.submit(verify_page, candidates, address), block))
+            if len(pending) >= self.processes * self.inflight:
+                merge(*pending.popleft())
+        while pending:
+            merge(*pending.popleft())
+        return found
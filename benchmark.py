@@ -0,0 +1,361 @@
+"""Benchmarks for the scrape, verify, decode and encode hot paths.
+
+Usage:
+    python benchmark.py [--sizes 1000,100000,1000000] [--output FILE]
+
+Runs entirely offline: a synthetic etherscan txlist is served by a local stub
+HTTP server, and the auditor is pointed at it; the same transactions are
+replayed as node blocks (backends.Replay) for the node scan. The fixture
+mixes legacy and
+batch signals from the audited address with non-signal calldata, signals from
+other senders and "SAE" payloads that aren't valid UTF-8.
+
+For each fixture size and stage this reports throughput (items/s), p50/p99
+latency per item (measured over chunks of items, or per HTTP page for
+scrape) and peak traced memory. Peak memory is measured in a second pass
+under tracemalloc so it doesn't skew the timings. Results are written as JSON
+(with the git commit, if any) so runs can be compared across commits."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+from auditor import Auditor
+from backends import EtherscanBackend, NodeBackend, Replay
+from publisher import Publisher
+from store import Store
+from transport import Transport
+import schema
+import subprocess
+import statistics
+import tracemalloc
+import threading
+import platform
+import argparse
+import time
+import json
+import sys
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+ADDRESS = "0x" + "5a" * 20
+OTHER = "0x" + "0b" * 20
+
+# Items per timed chunk for the in-memory stages.
+CHUNK = 1000
+
+
+class Fixture():
+    """ Deterministic synthetic txlist of `count` transactions for ADDRESS,
+    `per_block` per block. Transactions are generated on demand from their
+    index, so even the 1M fixture is never held in memory at once.
+
+    Out of every 100 transactions: 8 are legacy signals, 2 batch payloads of
+    4 signals, 2 "SAE" payloads that aren't valid UTF-8, 8 signals sent by
+    another address and the rest ordinary contract calls or plain sends."""
+
+    def __init__(self, data, count: int, per_block: int = 4):
+        self.count = count
+        self.per_block = per_block
+        codec = schema.registry(data).latest
+
+        # A spread of valid signals to cycle through.
+        values = [list(table.values()) for table in codec.reverse]
+        self.signals = [
+            codec.encode([v[i % len(v)] for v in values]).hex()
+            for i in range(64)]
+        self.batches = [
+            codec.pack([bytes.fromhex(s) for s in self.signals[i:i + 4]],
+                       [0, 30, 60, 90]).hex()
+            for i in range(0, 64, 4)]
+        self.invalid = ("SAE".encode() + b"\xff" * 8).hex()
+        self.call = "a9059cbb" + "00" * 12 + "11" * 20 + "%064x" % 10 ** 18
+
+    def tx(self, i):
+        """Return the etherscan-style dict for transaction i."""
+
+        block = i // self.per_block
+        kind = (i * 2654435761) % 100
+        sender = ADDRESS
+        if kind < 8:
+            data = self.signals[i % len(self.signals)]
+        elif kind < 10:
+            data = self.batches[i % len(self.batches)]
+        elif kind < 12:
+            data = self.invalid
+        elif kind < 20:
+            data, sender = self.signals[i % len(self.signals)], OTHER
+        elif kind < 60:
+            data = self.call
+        else:
+            data = ""
+        return {
+            "blockNumber": str(block),
+            "timeStamp": str(1500000000 + block * 13),
+            "hash": "0x%064x" % i,
+            "from": sender,
+            "to": ADDRESS,
+            "value": "5",
+            "input": "0x" + data}
+
+    def block(self, n):
+        """Return block n as eth_getBlockByNumber would with full
+        transactions, or None past the last block."""
+
+        first = n * self.per_block
+        if first >= self.count:
+            return None
+        txs = [self.tx(i) for i in range(
+            first, min(first + self.per_block, self.count))]
+        return {
+            "number": hex(n),
+            "timestamp": hex(1500000000 + n * 13),
+            "transactions": [
+                {"hash": tx["hash"], "from": tx["from"], "to": tx["to"],
+                 "input": tx["input"]} for tx in txs]}
+
+    def pages(self, size: int = 1000):
+        """Yield lists of transactions, size at a time."""
+
+        for start in range(0, self.count, size):
+            yield [self.tx(i) for i in range(
+                start, min(start + size, self.count))]
+
+    def txlist(self, startblock, page, offset, sort):
+        """Return the txlist result etherscan would for these parameters."""
+
+        if sort == "desc":
+            first = self.count - 1 - (page - 1) * offset
+            return [self.tx(i) for i in range(
+                first, max(first - offset, -1), -1)]
+        first = startblock * self.per_block + (page - 1) * offset
+        return [self.tx(i) for i in range(
+            first, min(first + offset, self.count))]
+
+
+class Chain(dict):
+    """Replay recording of a Fixture as a node's chain, with each block
+    generated when it's looked up rather than held in memory."""
+
+    def __init__(self, fixture):
+        dict.__init__(self)
+        self.fixture = fixture
+
+    def __missing__(self, key):
+        method, params = json.loads(key)
+        if method == "eth_blockNumber":
+            fixture = self.fixture
+            return hex((fixture.count - 1) // fixture.per_block)
+        if method == "eth_getBlockByNumber":
+            return self.fixture.block(int(params[0], 16))
+        raise KeyError(key)
+
+
+class Stub(BaseHTTPRequestHandler):
+    """Serves Fixture txlists in etherscan's response format."""
+
+    fixture = None
+
+    def do_GET(self):
+        q = dict(parse_qsl(urlparse(self.path).query))
+        result = self.fixture.txlist(
+            int(q.get("startblock", 0)), int(q.get("page", 1)),
+            int(q.get("offset", 10000)), q.get("sort", "asc"))
+        body = json.dumps({
+            "status": "1" if result else "0",
+            "message": "OK" if result else "No transactions found",
+            "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TimedTransport(Transport):
+    """Unthrottled Transport recording the latency of every GET."""
+
+    def __init__(self):
+        Transport.__init__(self, rate=None)
+        self.latencies = []
+
+    def get(self, url, **kwargs):
+        start = time.perf_counter()
+        response = Transport.get(self, url, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+
+def serve(fixture):
+    """Start a stub etherscan server for fixture on a free local port and
+    return (server, url)."""
+
+    handler = type("FixtureStub", (Stub,), {"fixture": fixture})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:" + str(server.server_port) + "/api"
+
+
+def chunked(fn, items):
+    """Call fn on CHUNK sized slices of items, returning per-item latencies
+    (one per chunk)."""
+
+    latencies = []
+    for start in range(0, len(items), CHUNK):
+        chunk = items[start:start + CHUNK]
+        begin = time.perf_counter()
+        fn(chunk)
+        latencies.append((time.perf_counter() - begin) / len(chunk))
+    return latencies
+
+
+def stages(data, fixture, url):
+    """Return (name, run) pairs; run() performs the stage once and returns
+    (items processed, per-item latencies in seconds)."""
+
+    transport = TimedTransport()
+    auditor = Auditor(
+        "", data, "", False, Store(), transport,
+        EtherscanBackend("", False, transport, url))
+    publisher = Publisher("", ADDRESS, "", data)
+    node_backend = NodeBackend("", Replay(Chain(fixture)))
+
+    # Inputs for the in-memory stages, built once outside the timings.
+    state = {}
+
+    def scrape():
+        del transport.latencies[:]
+        auditor.store = Store()
+        state['signals'] = auditor.scrape(ADDRESS)
+        return fixture.count, [
+            t / EtherscanBackend.PAGE_SIZE for t in transport.latencies]
+
+    def verify():
+        latencies = []
+        for page in fixture.pages():
+            begin = time.perf_counter()
+            auditor.signals(page, ADDRESS)
+            latencies.append((time.perf_counter() - begin) / len(page))
+        return fixture.count, latencies
+
+    def node():
+        latencies = []
+        begin = time.perf_counter()
+        for txs, block in node_backend.pages(ADDRESS):
+            auditor.signals(txs, ADDRESS)
+            now = time.perf_counter()
+            latencies.append(
+                (now - begin) / (node_backend.batch * fixture.per_block))
+            begin = now
+        return fixture.count, latencies
+
+    def decode():
+        signals = state['signals']
+        return len(signals), chunked(auditor.decode, signals)
+
+    def encode():
+        params = [auditor.codec.decode(v) for s in state['signals']
+                  for v in s.values()]
+        return len(params), chunked(publisher.encode_batch, params)
+
+    return [("scrape", scrape), ("verify", verify), ("node", node),
+            ("decode", decode), ("encode", encode)]
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values (nearest rank)."""
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def run(data, size):
+    """Benchmark every stage on a fixture of size transactions."""
+
+    fixture = Fixture(data, size)
+    server, url = serve(fixture)
+    results = []
+    try:
+        # Timing pass.
+        for name, stage in stages(data, fixture, url):
+            begin = time.perf_counter()
+            items, latencies = stage()
+            elapsed = time.perf_counter() - begin
+            results.append({
+                "size": size,
+                "stage": name,
+                "items": items,
+                "seconds": elapsed,
+                "throughput": items / elapsed if elapsed else None,
+                "p50_us": percentile(latencies, 50) * 1e6
+                if latencies else None,
+                "p99_us": percentile(latencies, 99) * 1e6
+                if latencies else None,
+                "mean_us": statistics.mean(latencies) * 1e6
+                if latencies else None})
+
+        # Memory pass.
+        for result, (name, stage) in zip(
+                results, stages(data, fixture, url)):
+            tracemalloc.start()
+            stage()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        server.shutdown()
+    return results
+
+
+def commit():
+    """Return the current git commit of this tree, or None."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scrape/verify/decode/encode hot paths.")
+    parser.add_argument(
+        "--sizes", default="1000,100000",
+        help="comma separated fixture sizes (e.g. 1000,100000,1000000)")
+    parser.add_argument("--data", default=os.path.join(HERE, "data.json"))
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    data = schema.Registry(args.data)
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for r in run(data, size):
+            results.append(r)
+            print("%9d %-7s %10.0f items/s  p50 %8.2fus  p99 %8.2fus  "
+                  "peak %8.1f MiB" % (
+                      r["size"], r["stage"], r["throughput"] or 0,
+                      r["p50_us"] or 0, r["p99_us"] or 0,
+                      r["peak_bytes"] / 2 ** 20), file=sys.stderr)
+
+    report = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": int(time.time()),
+        "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
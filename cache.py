@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import metrics as _metrics
+import threading
+import sqlite3
+import json
+import time
+
+
+class SignalCache():
+    """ SignalCache keeps audit results per address along with the latest
+    block seen for that address, so repeat audits of an address that hasn't
+    published anything new skip the scrape and decode entirely.
+
+    Entries younger than `ttl` seconds are returned as-is. Older entries are
+    revalidated with a cheap head check and only recomputed if the address's
+    latest block has moved. At most `maxsize` entries are kept in memory,
+    least recently used first out. If `path` is given, entries are also
+    written to an SQLite file there, so they survive between processes (e.g.
+    cron runs). Values must be JSON serializable."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache (
+            address TEXT PRIMARY KEY,
+            block INTEGER,
+            stamp REAL NOT NULL,
+            value TEXT NOT NULL);"""
+
+    def __init__(self, ttl: float = 60, maxsize: int = 1024, path=None,
+                 metrics=None):
+        self.ttl = ttl
+        self.metrics = metrics if metrics is not None else _metrics.NULL
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript(self.SCHEMA)
+
+    def get(self, address):
+        """Return the (block, stamp, value) entry for address, or None."""
+
+        address = address.lower()
+        with self.lock:
+            entry = self.entries.get(address)
+            if entry is not None:
+                self.entries.move_to_end(address)
+                return entry
+            if self.db is None:
+                return None
+            row = self.db.execute(
+                "SELECT block, stamp, value FROM cache WHERE address = ?",
+                (address,)).fetchone()
+            if row is None:
+                return None
+            entry = (row[0], row[1], json.loads(row[2]))
+            self.insert(address, entry)
+            return entry
+
+    def put(self, address, block, value, stamp=None):
+        """Cache value for address as of block."""
+
+        address = address.lower()
+        entry = (block, time.time() if stamp is None else stamp, value)
+        with self.lock:
+            self.insert(address, entry)
+            if self.db is not None:
+                with self.db:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                        (address, entry[0], entry[1], json.dumps(value)))
+
+    def insert(self, address, entry):
+        """Add an entry to the in-memory LRU. Caller must hold self.lock."""
+
+        self.entries[address] = entry
+        self.entries.move_to_end(address)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def fetch(self, address, head, compute):
+        """ Return the cached value for address, or a fresh one.
+
+        head() must return the address's latest block and is only called for
+        entries older than the TTL; compute() must return the up to date
+        value and is only called on a miss or when head() has moved."""
+
+        entry = self.get(address)
+        if entry is not None and time.time() - entry[1] < self.ttl:
+            self.hits += 1
+            self.metrics.count("cache_hits")
+            return entry[2]
+
+        block = head()
+        if entry is not None and entry[0] == block:
+            # Nothing new since we cached it; restart its TTL.
+            self.revalidations += 1
+            self.metrics.count("cache_revalidations")
+            self.put(address, block, entry[2])
+            return entry[2]
+
+        self.misses += 1
+        self.metrics.count("cache_misses")
+        value = compute()
+        self.put(address, block, value)
+        return value
+
+    def invalidate(self, address=None):
+        """Drop the entry for address, or every entry if address is None."""
+
+        with self.lock:
+            if address is None:
+                self.entries.clear()
+                if self.db is not None:
+                    with self.db:
+                        self.db.execute("DELETE FROM cache")
+            else:
+                self.entries.pop(address.lower(), None)
+                if self.db is not None:
+                    with self.db:
+                        self.db.execute(
+                            "DELETE FROM cache WHERE address = ?",
+                            (address.lower(),))
+
+    def stats(self):
+        """Return the cache's hit/miss counters and current size."""
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "size": len(self.entries)}
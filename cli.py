@@ -0,0 +1,325 @@
+"""Headless entry point for auditing, decoding and publishing signals.
+
+Usage:
+    python cli.py [--format json|csv] audit ADDRESS [ADDRESS ...]
+    python cli.py [--format json|csv] backfill [--processes N] [--full]
+        ADDRESS [ADDRESS ...]
+    python cli.py [--format json|csv] decode [TIMESTAMP:]SIGNAL [...]
+    python cli.py [--format json|csv] query [--days N] [--limit N]
+        [--address ADDRESS] [FIELD=LABEL ...]
+    python cli.py reindex
+    python cli.py publish [--batch] "BTCUSD,Perp-Swap,BitMEX,Momentum,..."
+
+Pass "-" in place of the arguments to read them from stdin, one per line.
+Credentials are read from the environment (SAE_ENDPOINT, SAE_ETHERSCAN_TOKEN,
+SAE_PUB_K, SAE_PVT_K, SAE_LIVE, SAE_STORE, SAE_INDEX, SAE_CACHE,
+SAE_CACHE_TTL) or the matching command line options.
+
+Audited signals are added to the index database, which query searches across
+publishers; reindex loads signals already in the store into it.
+
+Service is the importable equivalent for other processes. Heavy modules
+(requests, web3) are only imported by the commands that need them, and
+tkinter never is, so this runs on headless servers and starts quickly."""
+
+from schema import Registry
+import argparse
+import json
+import time
+import csv
+import sys
+import os
+
+# Defaults live next to this file, so cron jobs needn't cd here first.
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Service():
+    """ Non-GUI facade over Auditor and Publisher. Both are created on first
+    use, so e.g. decoding never connects to anything."""
+
+    def __init__(self, endpoint="", etherscan_api_token="", live=False,
+                 pub_k="", pvt_k="", data=os.path.join(HERE, "data.json"),
+                 store=os.path.join(HERE, "signals.db"), cache=None,
+                 ttl: float = 60, index=os.path.join(HERE, "index.db")):
+        self.endpoint = endpoint
+        self.token = etherscan_api_token
+        self.live = live
+        self.pub_k = pub_k
+        self.pvt_k = pvt_k
+        self.store_path = store
+        self.index_path = index
+        self.cache_path = cache
+        self.ttl = ttl
+
+        # Load and validate the data.json signal schema.
+        self.schema = Registry(data)
+
+        self._auditor = None
+        self._publisher = None
+        self._index = None
+
+    @property
+    def auditor(self):
+        """Auditor backed by the on-disk store."""
+
+        if self._auditor is None:
+            from auditor import Auditor
+            from cache import SignalCache
+            from store import Store
+            self._auditor = Auditor(
+                self.endpoint, self.schema, self.token, self.live,
+                Store(self.store_path),
+                cache=SignalCache(self.ttl, path=self.cache_path),
+                index=self.index)
+        return self._auditor
+
+    @property
+    def index(self):
+        """Cross-publisher signal index, or None if disabled."""
+
+        if self._index is None and self.index_path:
+            from index import Index
+            self._index = Index(self.schema, self.index_path)
+        return self._index
+
+    @property
+    def publisher(self):
+        """Publisher for the configured address and key."""
+
+        if self._publisher is None:
+            from publisher import Publisher
+            self._publisher = Publisher(
+                self.endpoint, self.pub_k, self.pvt_k, self.schema)
+        return self._publisher
+
+    def audit(self, addresses: list):
+        """Scrape the given addresses and return a list of decoded signal
+        dicts, ordered by address then time. Addresses that fail to audit
+        are reported on stderr and skipped."""
+
+        if len(addresses) == 1:
+            results = [(addresses[0], self.auditor.audit(addresses[0]))]
+        else:
+            results = sorted(
+                self.auditor.audit_many(addresses),
+                key=lambda r: addresses.index(r[0]))
+
+        rows = []
+        for address, result in results:
+            if isinstance(result, Exception):
+                failed(address, result)
+                continue
+            signals, decoded = result
+            for sig in signals:
+                for timestamp, signal in sig.items():
+                    rows.append(self.row(signal, timestamp, address))
+        return rows
+
+    def backfill(self, addresses: list, processes=None, full=False):
+        """Backfill the given addresses' histories into the store, verifying
+        and decoding across processes, and return decoded signal dicts for
+        the signals found. With full, re-verify from the first block rather
+        than each address's checkpoint. Addresses that fail are reported on
+        stderr and skipped."""
+
+        from backfill import Backfill
+
+        rows = []
+        with Backfill(self.auditor, processes) as backfill:
+            results = dict(backfill.run(addresses, startblock=0 if full
+                                        else None))
+        for address in addresses:
+            if isinstance(results[address], Exception):
+                failed(address, results[address])
+                continue
+            for signal, decoded in results[address]:
+                rows.append(self.row(signal.payload, signal.timestamp,
+                                     address, decoded[1:]))
+        return rows
+
+    def query(self, filters: dict, days=None, limit=None, address=None):
+        """Return indexed signals matching field label filters (and address,
+        if given) from the last days days, newest first."""
+
+        if self.index is None:
+            raise Exception("No signal index configured.")
+        start = None
+        if days is not None:
+            start = time.time() - days * 86400
+        return self.index.query(
+            limit=limit, descending=True, address=address, start=start,
+            **filters)
+
+    def reindex(self):
+        """Add every signal in the store to the index, returning how many
+        were indexed."""
+
+        if self.index is None:
+            raise Exception("No signal index configured.")
+        return self.index.update(self.auditor.store)
+
+    def decode(self, signals: list):
+        """Return decoded signal dicts for a list of encoded signal strings,
+        each optionally prefixed with "timestamp:"."""
+
+        rows = []
+        for s in signals:
+            timestamp, _, signal = s.rpartition(":")
+            rows.append(self.row(signal, timestamp or None))
+        return rows
+
+    def publish(self, signals: list, batch: bool = False):
+        """Encode and publish the given signal parameter lists, returning the
+        tx hashes. With batch, pack them into as few transactions as
+        possible."""
+
+        encoded = self.schema.encode_batch(signals)
+        if batch:
+            return self.publisher.publish_batch(encoded)
+        for signal in encoded:
+            self.publisher.enqueue(signal)
+        return self.publisher.flush()
+
+    def row(self, signal, timestamp=None, address=None, labels=None):
+        """Return a flat dict describing one encoded signal, decoding it
+        unless its field labels are given."""
+
+        if timestamp is not None:
+            timestamp = int(timestamp)
+        if labels is None:
+            labels = self.schema.decode(signal)
+        row = {"address": address, "timestamp": timestamp, "signal": signal}
+        row.update(zip(self.schema.fields, labels))
+        return row
+
+
+def failed(address, error):
+    """Report an address that couldn't be audited on stderr."""
+
+    print(address + ": " + str(error), file=sys.stderr)
+
+
+def write(rows: list, fmt, out=sys.stdout):
+    """Write a list of dicts to out as a JSON array or CSV with a header."""
+
+    if fmt == "csv":
+        if rows:
+            writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        json.dump(rows, out, indent=1)
+        out.write("\n")
+
+
+def inputs(args: list):
+    """Return the command's arguments, reading them from stdin (one per
+    non-blank line) if given as "-"."""
+
+    if args == ["-"]:
+        return [line.strip() for line in sys.stdin if line.strip()]
+    return args
+
+
+def main(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(
+        description="Audit, decode and publish trade signals on Ethereum.")
+    parser.add_argument("--endpoint", default=env("SAE_ENDPOINT", ""))
+    parser.add_argument(
+        "--etherscan-token", default=env("SAE_ETHERSCAN_TOKEN", ""),
+        help="API key, or comma separated keys to rotate between")
+    parser.add_argument(
+        "--live", action="store_true",
+        default=env("SAE_LIVE", "").lower() in ("1", "true"),
+        help="use Eth mainnet instead of the Ropsten testnet")
+    parser.add_argument("--pub-k", default=env("SAE_PUB_K", ""))
+    parser.add_argument("--pvt-k", default=env("SAE_PVT_K", ""))
+    parser.add_argument("--data", default=os.path.join(HERE, "data.json"))
+    parser.add_argument("--store", default=env(
+        "SAE_STORE", os.path.join(HERE, "signals.db")))
+    parser.add_argument(
+        "--index", default=env("SAE_INDEX", os.path.join(HERE, "index.db")),
+        help="cross-publisher signal index file (empty to disable)")
+    parser.add_argument(
+        "--cache", default=env("SAE_CACHE"),
+        help="file to cache audit results in between runs")
+    parser.add_argument(
+        "--ttl", type=float, default=float(env("SAE_CACHE_TTL", 60)),
+        help="seconds a cached audit is trusted without a head check")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    audit = commands.add_parser(
+        "audit", help="scrape and decode signals from addresses")
+    audit.add_argument("addresses", nargs="+")
+
+    backfill = commands.add_parser(
+        "backfill",
+        help="bulk scrape addresses, verifying across worker processes")
+    backfill.add_argument("addresses", nargs="+")
+    backfill.add_argument(
+        "--processes", type=int, help="worker processes (default: cores)")
+    backfill.add_argument(
+        "--full", action="store_true",
+        help="re-verify whole histories, ignoring store checkpoints")
+
+    decode = commands.add_parser(
+        "decode", help="decode [timestamp:]signal strings")
+    decode.add_argument("signals", nargs="+")
+
+    query = commands.add_parser(
+        "query", help="search indexed signals across publishers")
+    query.add_argument(
+        "filters", nargs="*", metavar="FIELD=LABEL",
+        help="e.g. instrument=BTCUSD direction=Long")
+    query.add_argument("--address")
+    query.add_argument(
+        "--days", type=float, help="only signals from the last N days")
+    query.add_argument("--limit", type=int)
+
+    commands.add_parser(
+        "reindex", help="add every signal in the store to the index")
+
+    publish = commands.add_parser(
+        "publish", help="publish comma separated signal parameters")
+    publish.add_argument("signals", nargs="+")
+    publish.add_argument(
+        "--batch", action="store_true",
+        help="pack the signals into as few transactions as possible")
+
+    args = parser.parse_args(argv)
+    if args.command == "query":
+        for f in args.filters:
+            if "=" not in f:
+                query.error("filters must be FIELD=LABEL, got " + repr(f))
+    token = args.etherscan_token
+    if "," in token:
+        token = token.split(",")
+    service = Service(
+        args.endpoint, token, args.live, args.pub_k,
+        args.pvt_k, args.data, args.store, args.cache, args.ttl, args.index)
+
+    if args.command == "audit":
+        rows = service.audit(inputs(args.addresses))
+    elif args.command == "backfill":
+        rows = service.backfill(
+            inputs(args.addresses), args.processes, args.full)
+    elif args.command == "decode":
+        rows = service.decode(inputs(args.signals))
+    elif args.command == "query":
+        filters = dict(f.split("=", 1) for f in args.filters)
+        rows = service.query(filters, args.days, args.limit, args.address)
+    elif args.command == "reindex":
+        rows = [{"indexed": service.reindex()}]
+    else:
+        signals = [s.split(",") for s in inputs(args.signals)]
+        hashes = service.publish(signals, args.batch)
+        rows = [{"txhash": h} for h in hashes]
+
+    write(rows, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+class Codec():
+    """ Codec compiles the data.json signal vocabulary into forward
+    (label -> code) and reverse (code -> label) lookup tables, one per field
+    in data.json order, so signals can be encoded and decoded without
+    walking the nested data dicts for every field of every signal.
+
+    A Codec covers one schema version (see schema.Registry). Signals of
+    version 0 are the original "SAE" + codes form; later versions put the
+    version number in decimal between the header and the codes, e.g.
+    "SAE1HCHMBMNBH", so old signals keep their meaning as the vocabulary
+    grows."""
+
+    # Prefix of every encoded signal; see Publisher.encode.
+    HEADER = "SAE"
+
+    # Batch payloads pack many signals into one transaction:
+    #   "SAE" | format (1 byte) | count (1 byte) | count * record
+    # where each record is a big-endian uint16 offset in seconds back from
+    # the transaction's timestamp, followed by one 4 bit code index per field
+    # (in data.json order), padded to a whole byte. Format 1 batches hold
+    # schema version 0 signals; format 2 adds a schema version byte before
+    # the count.
+    BATCH_VERSION = 1
+    BATCH_HEADER = HEADER.encode() + bytes([BATCH_VERSION])
+    VERSIONED_BATCH_VERSION = 2
+    VERSIONED_BATCH_HEADER = HEADER.encode() + bytes(
+        [VERSIONED_BATCH_VERSION])
+    BATCH_MAX = 255
+    MAX_OFFSET = 0xFFFF
+
+    def __init__(self, data, version: int = 0):
+        self.version = version
+        # Encoded signals start with prefix; batches with batch_header.
+        if version:
+            self.prefix = self.HEADER + str(version)
+            self.batch_header = self.VERSIONED_BATCH_HEADER + bytes([version])
+        else:
+            self.prefix = self.HEADER
+            self.batch_header = self.BATCH_HEADER
+
+        self.fields = list(data['data'])
+        # Where a label appears under more than one code, the first code wins.
+        self.forward = [
+            {label: code
+                for code, label in reversed(list(data['data'][f].items()))}
+            for f in self.fields]
+        self.reverse = [dict(data['data'][f]) for f in self.fields]
+
+        # Code <-> position tables for bit-packed batch payloads.
+        self.codes = [list(table) for table in self.reverse]
+        self.positions = [
+            {code: i for i, code in enumerate(codes)} for codes in self.codes]
+        self.record_len = 2 + (len(self.fields) + 1) // 2
+        self.signal_len = len(self.prefix) + len(self.fields)
+
+    def encode(self, params: list):
+        """Return an encoded signal byte string given a list of signal
+        parameter strings, one per field. Raise an exception if a parameter
+        doesn't match an entry in its field."""
+
+        if len(params) != len(self.fields):
+            raise Exception("Signal parameter mis-match. Expected " +
+                            str(len(self.fields)) + " parameters.")
+        try:
+            codes = [table[p] for table, p in zip(self.forward, params)]
+        except KeyError as e:
+            raise Exception("Signal parameter mis-match. Ensure input " +
+                            "strings match each field in data.json.", e)
+        return bytes(self.prefix + "".join(codes), 'utf-8')
+
+    def encode_batch(self, signals: list):
+        """Return a list of encoded signal byte strings, given a list of
+        signal parameter lists."""
+
+        return [self.encode(params) for params in signals]
+
+    def matches(self, signal: str):
+        """Return True if signal is an encoded signal of this version, with
+        a known code for every field, so decode() won't fail on it."""
+
+        return len(signal) == self.signal_len and \
+            signal.startswith(self.prefix) and all(
+                code in table for table, code in zip(
+                    self.reverse, signal[len(self.prefix):]))
+
+    def decode(self, signal: str):
+        """Return the list of parameter strings for an encoded signal string.
+        Raise KeyError if the signal contains an unknown code."""
+
+        return [table[code] for table, code in zip(
+            self.reverse, signal[len(self.prefix):])]
+
+    def decode_batch(self, signals: list, columnar: bool = False):
+        """Return decoded parameter lists for a list of encoded signal
+        strings. If columnar is set, return a dict of field name to a list of
+        that field's values instead, in the same order as signals."""
+
+        rows = [self.decode(s) for s in signals]
+        if not columnar:
+            return rows
+        return {f: list(col) for f, col in zip(
+            self.fields, zip(*rows) if rows else [()] * len(self.fields))}
+
+    def pack(self, signals: list, offsets: list = None):
+        """ Return a batch payload packing the given encoded signals (as
+        returned by encode()) into one transaction's data. offsets are each
+        signal's age in seconds at the time of publishing, defaulting to 0,
+        and are clamped to what fits in a record.
+
+        Raise an exception if there are more signals than fit in a batch or a
+        field has too many values to pack into 4 bits."""
+
+        if len(signals) > self.BATCH_MAX:
+            raise Exception("Too many signals for one batch payload. Max " +
+                            str(self.BATCH_MAX) + ".")
+        if offsets is None:
+            offsets = [0] * len(signals)
+
+        payload = bytearray(self.batch_header)
+        payload.append(len(signals))
+        for signal, offset in zip(signals, offsets):
+            if isinstance(signal, bytes):
+                signal = signal.decode()
+            nibbles = []
+            for positions, code in zip(
+                    self.positions, signal[len(self.prefix):]):
+                i = positions[code]
+                if i > 0xF:
+                    raise Exception("Signal code " + code + " can't be " +
+                                    "packed; field has over 16 values.")
+                nibbles.append(i)
+            if len(nibbles) % 2:
+                nibbles.append(0)
+            payload += max(0, min(self.MAX_OFFSET, int(offset))).to_bytes(
+                2, 'big')
+            payload += bytes(
+                hi << 4 | lo for hi, lo in zip(nibbles[::2], nibbles[1::2]))
+        return bytes(payload)
+
+    def unpack(self, payload: bytes):
+        """Return a list of (offset, signal string) tuples from a batch
+        payload, with each signal in the single encode() form. Raise
+        ValueError if the payload is malformed."""
+
+        if payload[:len(self.batch_header)] != self.batch_header:
+            raise ValueError("Not a batch signal payload.")
+        start = len(self.batch_header) + 1
+        count = payload[start - 1]
+        if len(payload) != start + count * self.record_len:
+            raise ValueError("Batch signal payload length mismatch.")
+
+        result = []
+        for pos in range(start, len(payload), self.record_len):
+            offset = int.from_bytes(payload[pos:pos + 2], 'big')
+            packed = payload[pos + 2:pos + self.record_len]
+            nibbles = [n for b in packed for n in (b >> 4, b & 0xF)]
+            try:
+                codes = [c[n] for c, n in zip(self.codes, nibbles)]
+            except IndexError:
+                raise ValueError("Unknown code in batch signal payload.")
+            result.append((offset, self.prefix + "".join(codes)))
+        return result
@@ -0,0 +1,236 @@
+import threading
+import sqlite3
+import schema
+
+
+class Index():
+    """ Index is a persistent, queryable database of audited signals across
+    every publisher, with each signal decoded into a column per data.json
+    field, so questions like "all Long BTCUSD signals on BitMEX in the last
+    week" are answered from indexes rather than by re-scraping.
+
+    Pass an Index to the Auditor and every signal it scrapes, proves or
+    watches is added as it lands; update() loads what a Store already holds.
+    Signals are keyed like the store's, so adding one twice is harmless.
+    Merkle roots are indexed too, with the number of signals committed
+    under each and the number proven, so roots() can list publishers
+    withholding committed signals.
+
+    Instrument, exchange, direction and strategy each have an index with
+    time, as does time on its own and publisher address, so filtered queries
+    over millions of signals only touch matching rows. Columns for fields
+    added by later schema versions are created on open; older signals have
+    NULL there.
+
+        index = Index(registry, "index.db")
+        index.query(instrument="BTCUSD", exchange="BitMEX",
+                    direction="Long", start=time.time() - 7 * 86400)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS signals (
+            address TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            block INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            signal TEXT NOT NULL,
+            PRIMARY KEY (hash, timestamp, signal));
+        CREATE TABLE IF NOT EXISTS commitments (
+            address TEXT NOT NULL,
+            root TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            block INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            committed INTEGER,
+            PRIMARY KEY (address, root));
+        CREATE TABLE IF NOT EXISTS proven (
+            address TEXT NOT NULL,
+            root TEXT NOT NULL,
+            leaf TEXT NOT NULL,
+            PRIMARY KEY (address, root, leaf));"""
+
+    # Fields given their own (field, timestamp) index.
+    INDEXED = ("instrument", "exchange", "direction", "strategy")
+
+    COLUMNS = ("address", "hash", "block", "timestamp", "signal")
+
+    def __init__(self, data, path=":memory:"):
+        self.path = path
+        self.codec = schema.registry(data)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        self.fields = list(self.codec.fields)
+        for f in self.fields:
+            if not f.isidentifier() or f in self.COLUMNS:
+                raise Exception("Can't index field " + repr(f) + ".")
+
+        with self.db:
+            self.db.executescript(self.SCHEMA)
+            existing = {row[1] for row in self.db.execute(
+                "PRAGMA table_info(signals)")}
+            for f in self.fields:
+                if f not in existing:
+                    self.db.execute(
+                        "ALTER TABLE signals ADD COLUMN " + f + " TEXT")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS signals_timestamp " +
+                "ON signals (timestamp)")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS signals_address " +
+                "ON signals (address, timestamp)")
+            for f in self.INDEXED:
+                if f in self.fields:
+                    self.db.execute(
+                        "CREATE INDEX IF NOT EXISTS signals_" + f +
+                        " ON signals (" + f + ", timestamp)")
+
+        self.insert = "INSERT OR IGNORE INTO signals (" + ", ".join(
+            self.COLUMNS + tuple(self.fields)) + ") VALUES (" + ", ".join(
+            "?" * (len(self.COLUMNS) + len(self.fields))) + ")"
+
+    def add(self, signals):
+        """ Add (address, hash, block, timestamp, signal) records, such as
+        auditor Signal records or Store.records() rows, in a single
+        transaction. Signals that don't decode are skipped. Return the number
+        of records indexed, counting ones already there."""
+
+        rows = []
+        for address, txhash, block, timestamp, signal in signals:
+            try:
+                values = self.codec.decode(signal)
+            except (KeyError, ValueError):
+                continue
+            rows.append((address.lower(), txhash, int(block), int(timestamp),
+                         signal, *values))
+        with self.lock, self.db:
+            self.db.executemany(self.insert, rows)
+        return len(rows)
+
+    def add_roots(self, commitments):
+        """Add merkle.Commitment records of published roots."""
+
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO commitments VALUES (?, ?, ?, ?, ?, ?)",
+                [(c.address.lower(), c.root, c.hash, int(c.block),
+                  int(c.timestamp), c.count) for c in commitments])
+
+    def prove(self, address, root, leaf):
+        """Record the leaf hash (hex) of a signal proven under root (hex)."""
+
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO proven VALUES (?, ?, ?)",
+                (address.lower(), root.lower(), leaf.lower()))
+
+    def roots(self, address=None, withheld: bool = False):
+        """ Return indexed Merkle roots as dicts of address, root, hash,
+        block, timestamp, committed (signals committed under the root, None
+        if unknown) and proven (distinct signals proven), oldest first. With
+        withheld, only roots with fewer signals proven than committed."""
+
+        query = "SELECT c.address, c.root, c.hash, c.block, c.timestamp, " + \
+            "c.committed, COUNT(p.leaf) AS n FROM commitments c LEFT JOIN " + \
+            "proven p ON p.address = c.address AND p.root = c.root"
+        params = []
+        if address is not None:
+            query += " WHERE c.address = ?"
+            params.append(address.lower())
+        query += " GROUP BY c.address, c.root"
+        if withheld:
+            query += " HAVING n < c.committed"
+        with self.lock:
+            rows = self.db.execute(
+                query + " ORDER BY c.timestamp", params).fetchall()
+        names = ("address", "root", "hash", "block", "timestamp",
+                 "committed", "proven")
+        return [dict(zip(names, row)) for row in rows]
+
+    def update(self, store, address=None, chunk: int = 10000):
+        """Add everything in store (or just address's signals and roots),
+        chunk rows per transaction. Return the number of signal records
+        indexed."""
+
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO commitments VALUES (?, ?, ?, ?, ?, ?)",
+                [(r["address"], r["root"], r["hash"], r["block"],
+                  r["timestamp"], r["committed"])
+                 for r in store.roots(address)])
+            self.db.executemany(
+                "INSERT OR IGNORE INTO proven VALUES (?, ?, ?)",
+                store.leaves(address))
+
+        total = 0
+        batch = []
+        for record in store.records(address):
+            batch.append(record)
+            if len(batch) >= chunk:
+                total += self.add(batch)
+                batch = []
+        return total + self.add(batch)
+
+    def where(self, address=None, start=None, end=None, **fields):
+        """Return (SQL where clause, params) for query() filters."""
+
+        clauses, params = [], []
+        if address is not None:
+            clauses.append("address = ?")
+            params.append(address.lower())
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(int(start))
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(int(end))
+        for f, value in fields.items():
+            if f not in self.fields:
+                raise Exception("Unknown signal field " + repr(f) + ".")
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(
+                    f + " IN (" + ", ".join("?" * len(value)) + ")")
+                params.extend(value)
+            else:
+                clauses.append(f + " = ?")
+                params.append(value)
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def query(self, limit=None, descending: bool = False, **filters):
+        """ Return matching signals as dicts of address, hash, block,
+        timestamp, signal and each field's label, oldest first (or newest
+        first if descending), at most limit of them.
+
+        Filters are a publisher address, a unix time range [start, end) and
+        field labels by field name; a list of labels matches any of them."""
+
+        where, params = self.where(**filters)
+        sql = "SELECT " + ", ".join(self.COLUMNS + tuple(self.fields)) + \
+            " FROM signals" + where + " ORDER BY timestamp" + \
+            (" DESC" if descending else "")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        names = self.COLUMNS + tuple(self.fields)
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [dict(zip(names, row)) for row in rows]
+
+    def count(self, **filters):
+        """Return the number of signals matching query() filters."""
+
+        where, params = self.where(**filters)
+        with self.lock:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM signals" + where, params).fetchone()[0]
+
+    def publishers(self, **filters):
+        """Return {address: number of matching signals}, busiest first."""
+
+        where, params = self.where(**filters)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT address, COUNT(*) AS n FROM signals" + where +
+                " GROUP BY address ORDER BY n DESC", params).fetchall()
+        return dict(rows)
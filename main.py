@@ -1,8 +1,13 @@
 from auditor import Auditor
 from publisher import Publisher
+from schema import Registry
+from store import Store
+from index import Index
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import tkinter as tk
 from tkinter import ttk
-import json
+import queue
 import time
 
 
@@ -27,6 +32,19 @@ class App(tk.Frame):
     # Get one at https://etherscan.io.
     ETHERSCAN_API_TOKEN = ""
 
+    # Local database of scraped signals and per-address scan checkpoints.
+    STORE = "signals.db"
+
+    # Cross-publisher index of every audited signal; see cli.py query.
+    INDEX = "index.db"
+
+    # Audit and publish actions run on this many worker threads. Results
+    # are passed back to the Tk thread through a queue polled every POLL ms,
+    # inserting at most BATCH output rows per poll.
+    WORKERS = 4
+    POLL = 50
+    BATCH = 500
+
     def __init__(self, parent, *args, **kwargs):
         tk.Frame.__init__(self, parent, *args, **kwargs)
         self.parent = parent
@@ -37,23 +55,36 @@ class App(tk.Frame):
         else:
             self.endpoint = self.TESTNET
 
-        # Load data.json signal dict.
-        with open("data.json") as file:
-            self.data = json.load(file)
+        # Load the data.json signal schema, and its latest vocabulary for
+        # the publishing form.
+        self.schema = Registry("data.json")
+        self.data = self.schema.data
 
         # Init component modules.
         self.auditor = Auditor(
             self.endpoint,
-            self.data,
+            self.schema,
             self.ETHERSCAN_API_TOKEN,
-            self.LIVE)
+            self.LIVE,
+            Store(self.STORE),
+            index=Index(self.schema, self.INDEX))
         self.publisher = Publisher(
             self.endpoint,
             self.pub_k,
             self.pvt_k,
-            self.data)
+            self.schema)
+
+        # Worker pool for network actions, and the queue they report back on.
+        self.pool = ThreadPoolExecutor(max_workers=self.WORKERS)
+        self.results = queue.Queue()
+        self.running = 0
+
+        # Output rows taken off the queue but not yet inserted; a single
+        # emit() can carry far more than BATCH rows. Tk thread only.
+        self.backlog = deque()
 
         self.init_gui()
+        self.after(self.POLL, self.poll)
 
         # Check if address and key are valid
         self.output.insert(
@@ -66,7 +97,8 @@ class App(tk.Frame):
 
     def publish(self):
         """Publish signal composed from gui combobox inputs to Ethereum,
-        then print results and tx hash in the output pane."""
+        then print results and tx hash in the output pane. Encoding and
+        publishing run on a worker thread."""
 
         # No need to check address & key as they are validated at init.
         # Signal is formed from combobox value strings
@@ -80,59 +112,123 @@ class App(tk.Frame):
             self.misccbb.get(),
             self.triggercbb.get()]
 
+        self.run("Publishing signal", self.publish_worker, signal)
+
+    def publish_worker(self, signal):
+        """publish() worker thread body."""
+
         # Print params to output pane
-        self.output.insert(
-            self.output.size() + 1,
-            "Raw signal: " + str(signal))
+        self.emit("Raw signal: " + str(signal))
 
         # Encode param strings
         encoded = self.publisher.encode(signal)
-        self.output.insert(
-            self.output.size() + 1,
-            "Encoded signal: " + str(encoded))
+        self.emit("Encoded signal: " + str(encoded))
 
         # Publish and print hash
         txhash = self.publisher.publish(encoded)
-        self.output.insert(
-            self.output.size() + 1,
-            "Published signal. Tx hash: " + str(txhash))
+        self.emit("Published signal. Tx hash: " + str(txhash))
 
     def audit(self):
-        """Scrape and audit tx's using address parameter from addr_field
-        then print the results in the output pane."""
-
-        # Double check address is valid.
-        address = self.addr_field.get()
-        if not self.auditor.validate(address) == "Valid":
-            self.output.insert(
-                self.output.size() + 1, "Invalid address.")
-        # Print to ouput pane
-        result = self.auditor.scrape(address)
-        if result:
-            # First print the raw signal
-            self.output.insert(
-                self.output.size() + 1, str(len(result)) +
-                " encoded signals found at " + str(address) + ":")
-            for i in result:
-                self.output.insert(
-                    self.output.size() + 1,
-                    i)
-
-            # Now print decoded human-readable signals
-            decoded = self.auditor.decode(result)
-            self.output.insert(
-                self.output.size() + 1,
-                "Decoded signal output:")
-            for i in decoded:
+        """Scrape and audit tx's using the address parameter(s) from
+        addr_field, then print the results in the output pane. Several
+        addresses can be given separated by commas or spaces; they are
+        scraped concurrently on a worker thread."""
+
+        # Double check addresses are valid.
+        addresses = self.addr_field.get().replace(",", " ").split()
+        for address in addresses:
+            if not self.auditor.validate(address) == "Valid":
                 self.output.insert(
-                    self.output.size() + 1,
-                    i)
-        else:
-            self.output.insert(
-                self.output.size() + 1,
-                str("No signals present for address " + address + "."))
+                    self.output.size() + 1, "Invalid address: " + address)
+                return
+        if addresses:
+            self.run("Auditing " + str(len(addresses)) + " address(es)",
+                     self.audit_worker, addresses)
+
+    def audit_worker(self, addresses):
+        """audit() worker thread body. Reports each address as its audit
+        completes; repeat audits are served from the auditor's cache."""
+
+        done = 0
+        for address, outcome in self.auditor.audit_many(addresses):
+            done += 1
+            self.status_update(
+                "Audited " + str(done) + "/" + str(len(addresses)) +
+                " addresses...")
+            if isinstance(outcome, Exception):
+                self.emit("Audit of " + address + " failed: " + str(outcome))
+                continue
+            result, decoded = outcome
+            if result:
+                # First print the raw signal, then decoded human-readable
+                # signals.
+                self.emit(
+                    str(len(result)) + " encoded signals found at " +
+                    str(address) + ":", *result)
+                self.emit("Decoded signal output:", *decoded)
+            else:
+                self.emit(
+                    "No signals present for address " + address + ".")
+
+    def run(self, label, worker, *args):
+        """Run worker(*args) on the worker pool, reporting progress, timing
+        and any error in the status bar and output pane."""
+
+        def job():
+            start = time.monotonic()
+            try:
+                worker(*args)
+            except Exception as e:
+                self.emit(label + " failed: " + str(e))
+                outcome = "failed"
+            else:
+                outcome = "done"
+            self.results.put(("done", label + " " + outcome + " in " + str(
+                round(time.monotonic() - start, 2)) + "s."))
+
+        self.running += 1
+        self.status.config(text=label + "...")
+        self.pool.submit(job)
+
+    def emit(self, *rows):
+        """Queue rows for the output pane. Safe to call from any thread."""
+
+        self.results.put(("rows", rows))
+
+    def status_update(self, text):
+        """Queue a status bar message. Safe to call from any thread."""
+
+        self.results.put(("status", text))
+
+    def poll(self):
+        """Drain queued worker results on the Tk thread, inserting at most
+        BATCH output rows per call, then reschedule."""
+
+        status = None
+        try:
+            while len(self.backlog) < self.BATCH:
+                kind, item = self.results.get_nowait()
+                if kind == "rows":
+                    self.backlog.extend(item)
+                elif kind == "status":
+                    status = item
+                else:
+                    self.running -= 1
+                    status = item
+        except queue.Empty:
             pass
 
+        rows = [self.backlog.popleft()
+                for _ in range(min(self.BATCH, len(self.backlog)))]
+        if rows:
+            self.output.insert(tk.END, *rows)
+            self.output.see(tk.END)
+        if status:
+            if self.running:
+                status += "  (" + str(self.running) + " running)"
+            self.status.config(text=status)
+        self.after(self.POLL, self.poll)
+
     def to_clipboard(self, item):
         """Write the given object to system clipboard."""
 
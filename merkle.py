@@ -0,0 +1,271 @@
+from collections import namedtuple
+from codec import Codec
+import threading
+import hashlib
+import logging
+import sqlite3
+import json
+import time
+import os
+
+log = logging.getLogger(__name__)
+
+# A Merkle root published on chain: originating address, tx hash, block
+# number, unix timestamp, the root as 64 hex digits and the number of signals
+# the publisher committed to under it.
+Commitment = namedtuple(
+    "Commitment", "address hash block timestamp root count")
+
+# Commitment payloads are "SAE" | format 3 | 32 byte root | uint32 count.
+COMMIT_VERSION = 3
+COMMIT_HEADER = Codec.HEADER.encode() + bytes([COMMIT_VERSION])
+COMMIT_LEN = len(COMMIT_HEADER) + 32 + 4
+
+# How long before its commitment a signal may claim to have been made,
+# matching the furthest back a batch payload's offsets can claim.
+MAX_AGE = Codec.MAX_OFFSET
+
+
+def leaf(salt: bytes, timestamp: int, signal: str):
+    """ Return the leaf hash of a signal. The random salt keeps a published
+    root from giving away its signals to anyone guessing at the small
+    vocabulary; leaves and nodes are hashed with distinct prefixes so a node
+    can't pass for a leaf."""
+
+    return hashlib.sha256(
+        b"\x00" + salt + int(timestamp).to_bytes(8, 'big') +
+        signal.encode()).digest()
+
+
+def node(left: bytes, right: bytes):
+    """Return the hash of an interior node."""
+
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def payload(root: bytes, count: int):
+    """Return the transaction data committing to root over count signals."""
+
+    return COMMIT_HEADER + root + count.to_bytes(4, 'big')
+
+
+def parse(data: bytes):
+    """Return (root, count) from commitment transaction data. Raise
+    ValueError if it isn't one."""
+
+    if len(data) != COMMIT_LEN or not data.startswith(COMMIT_HEADER):
+        raise ValueError("Not a signal commitment payload.")
+    start = len(COMMIT_HEADER)
+    return data[start:start + 32], int.from_bytes(data[start + 32:], 'big')
+
+
+class Tree():
+    """ Merkle tree over a list of leaf hashes. A node without a sibling is
+    carried up to the next level unchanged, so a proof is at most
+    ceil(log2(n)) sibling hashes."""
+
+    def __init__(self, leaves: list):
+        if not leaves:
+            raise Exception("Can't build a Merkle tree with no leaves.")
+        self.levels = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            self.levels.append([
+                node(level[i], level[i + 1]) if i + 1 < len(level)
+                else level[i] for i in range(0, len(level), 2)])
+
+    @property
+    def root(self):
+        return self.levels[-1][0]
+
+    def proof(self, index: int):
+        """Return the inclusion proof for leaf index as a list of
+        [side, sibling hex] pairs from the leaf up, side being "L" or "R" for
+        a sibling on the left or right."""
+
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append(
+                    ["L" if sibling < index else "R", level[sibling].hex()])
+            index //= 2
+        return path
+
+
+def verify(root: bytes, leaf_hash: bytes, path: list):
+    """Return True if path proves leaf_hash is included under root."""
+
+    digest = leaf_hash
+    for side, sibling in path:
+        sibling = bytes.fromhex(sibling)
+        if side == "L":
+            digest = node(sibling, digest)
+        elif side == "R":
+            digest = node(digest, sibling)
+        else:
+            return False
+    return digest == root
+
+
+class ProofIndex():
+    """ ProofIndex keeps the proofs for every committed signal in a local
+    SQLite database, so any signal can be proven to an auditor long after
+    its root was published.
+
+    Proofs are JSON-serializable dicts:
+
+        {"root": hex, "index": int, "salt": hex, "timestamp": int,
+         "signal": "SAE...", "path": [[side, hex], ...]}
+
+    which Auditor.prove() checks against the root published on chain."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS roots (
+            root TEXT PRIMARY KEY,
+            hash TEXT,
+            count INTEGER NOT NULL,
+            stamp REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS proofs (
+            root TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            salt TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            signal TEXT NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (root, idx));
+        CREATE INDEX IF NOT EXISTS proofs_signal
+            ON proofs (signal, timestamp);"""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript(self.SCHEMA)
+        self.lock = threading.Lock()
+
+    def add(self, root: bytes, txhash, leaves: list, tree):
+        """Record the proofs of a committed tree, leaves being its (salt,
+        timestamp, signal) entries in leaf order."""
+
+        root = root.hex()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO roots VALUES (?, ?, ?, ?)",
+                (root, txhash, len(leaves), time.time()))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO proofs VALUES (?, ?, ?, ?, ?, ?)",
+                [(root, i, salt.hex(), timestamp, signal,
+                  json.dumps(tree.proof(i)))
+                 for i, (salt, timestamp, signal) in enumerate(leaves)])
+
+    def proofs(self, signal=None, root=None):
+        """Return proof dicts, oldest first, for every committed copy of
+        signal and/or everything under root."""
+
+        query = "SELECT root, idx, salt, timestamp, signal, path FROM proofs"
+        clauses, params = [], []
+        if signal is not None:
+            clauses.append("signal = ?")
+            params.append(signal)
+        if root is not None:
+            clauses.append("root = ?")
+            params.append(root.hex() if isinstance(root, bytes) else root)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with self.lock:
+            rows = self.db.execute(
+                query + " ORDER BY timestamp, root, idx", params).fetchall()
+        return [
+            {"root": r, "index": i, "salt": s, "timestamp": t, "signal": sig,
+             "path": json.loads(p)}
+            for r, i, s, t, sig, p in rows]
+
+    def transaction(self, root):
+        """Return the tx hash root was published in, or None."""
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT hash FROM roots WHERE root = ?",
+                (root.hex() if isinstance(root, bytes) else root,)).fetchone()
+        return row[0] if row else None
+
+
+class Committer():
+    """ Commitment mode for publishing: rather than a transaction per signal
+    (or per 255 signals with Publisher.publish_batch), signals are collected
+    off chain and only the Merkle root of each batch is published, in one
+    "SAE" transaction, so throughput isn't bound by inclusion rate or gas.
+    Every signal's proof goes into the proof index for auditors.
+
+    Call commit() to publish what's been added, or start() to commit every
+    `interval` seconds on a background thread.
+
+        committer = Committer(publisher, ProofIndex("proofs.db"))
+        committer.add(publisher.encode(params))
+        txhash, root = committer.commit()"""
+
+    def __init__(self, publisher, index=None, interval: float = 60):
+        self.publisher = publisher
+        self.index = index if index is not None else ProofIndex()
+        self.interval = interval
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add(self, signal, timestamp=None):
+        """Queue an encoded signal for the next commitment, stamped with
+        timestamp (unix seconds, default now)."""
+
+        if isinstance(signal, bytes):
+            signal = signal.decode()
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.pending.append((os.urandom(16), int(timestamp), signal))
+
+    def commit(self):
+        """Publish the root of all queued signals and index their proofs.
+        Return (tx hash, root), or None if nothing was queued. If publishing
+        fails the signals stay queued for the next attempt."""
+
+        with self.lock:
+            leaves, self.pending = self.pending, []
+        if not leaves:
+            return None
+
+        tree = Tree([leaf(*entry) for entry in leaves])
+        try:
+            txhash = self.publisher.publish(payload(tree.root, len(leaves)))
+        except Exception:
+            with self.lock:
+                self.pending[:0] = leaves
+            raise
+        self.index.add(tree.root, txhash, leaves, tree)
+        return txhash, tree.root
+
+    def start(self):
+        """Commit every interval seconds on a background daemon thread."""
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """Stop the background thread, committing anything still queued."""
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.commit()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.commit()
+            except Exception:
+                # Left queued; retried on the next tick.
+                log.exception("Committing signals failed; retrying in %ss.",
+                              self.interval)
@@ -0,0 +1,199 @@
+from collections import defaultdict
+import threading
+import time
+import json
+import sys
+
+
+class Metrics():
+    """ Timing spans and counters for the auditor and publisher hot paths,
+    reported to a pluggable sink: MemorySink, PrometheusSink or JsonLogSink.
+
+    With no sink, metrics are disabled and every call returns straight away
+    (span() hands back a shared no-op context manager), so instrumented code
+    costs next to nothing unless someone is listening.
+
+        metrics = Metrics(PrometheusSink())
+        auditor = Auditor(..., metrics=metrics)
+        with metrics.span("scrape", address=address):
+            ...
+        metrics.count("txs_scanned", len(txs))"""
+
+    def __init__(self, sink=None):
+        self.sink = sink
+
+    def count(self, name, value=1, **labels):
+        """Add value to the counter name."""
+
+        if self.sink is None:
+            return
+        self.sink.count(name, value, labels)
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration for the timer name."""
+
+        if self.sink is None:
+            return
+        self.sink.observe(name, seconds, labels)
+
+    def span(self, name, **labels):
+        """Return a context manager timing its block as timer name."""
+
+        if self.sink is None:
+            return NULL_SPAN
+        return Span(self.sink, name, labels)
+
+
+class Span():
+    """Times a with block and reports it to a sink."""
+
+    __slots__ = ("sink", "name", "labels", "start")
+
+    def __init__(self, sink, name, labels):
+        self.sink = sink
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.sink.observe(
+            self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class NullSpan():
+    """Span stand-in used while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+# Shared disabled instance, the default wherever metrics are optional.
+NULL = Metrics()
+
+
+class MemorySink():
+    """ Aggregates counters and timers in memory. snapshot() returns
+    {"counters": {key: total}, "timers": {key: {count, sum, max}}}, keyed by
+    name plus any labels as name{label=value,...}."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.timers = {}
+
+    def count(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, seconds, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @staticmethod
+    def label(key):
+        """Return name{label=value,...} for a (name, labels) key."""
+
+        name, labels = key
+        if not labels:
+            return name
+        return name + "{" + ",".join(
+            k + "=" + str(v) for k, v in labels) + "}"
+
+    def snapshot(self):
+        """Return a copy of the current counters and timers."""
+
+        with self.lock:
+            return {
+                "counters": {
+                    self.label(k): v for k, v in self.counters.items()},
+                "timers": {
+                    self.label(k): {"count": c, "sum": s, "max": m}
+                    for k, (c, s, m) in self.timers.items()}}
+
+
+class PrometheusSink(MemorySink):
+    """ MemorySink that renders in the Prometheus text exposition format:
+    counters as <prefix>_<name>_total and timers as <prefix>_<name>_seconds
+    summaries. Serve render() from an HTTP endpoint to have it scraped."""
+
+    def __init__(self, prefix="signal_auditor"):
+        MemorySink.__init__(self)
+        self.prefix = prefix
+
+    @staticmethod
+    def labels(labels, **extra):
+        pairs = list(labels) + sorted(extra.items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(
+            k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+            for k, v in pairs) + "}"
+
+    def render(self):
+        """Return all metrics as Prometheus exposition text."""
+
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = self.prefix + "_" + name + "_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE " + metric + " counter")
+            lines.append(metric + self.labels(labels) + " " + repr(value))
+
+        for (name, labels), (count, total, peak) in timers:
+            metric = self.prefix + "_" + name + "_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE " + metric + " summary")
+            lines.append(metric + "_count" + self.labels(labels) + " " +
+                         str(count))
+            lines.append(metric + "_sum" + self.labels(labels) + " " +
+                         repr(total))
+            lines.append(metric + self.labels(labels, quantile="1") + " " +
+                         repr(peak))
+        return "\n".join(lines) + "\n"
+
+
+class JsonLogSink():
+    """Writes every counter increment and timing as a JSON line to stream
+    (stderr by default), for log shipping."""
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stderr
+        self.lock = threading.Lock()
+
+    def count(self, name, value, labels):
+        self.write({"type": "counter", "name": name, "value": value,
+                    "labels": labels})
+
+    def observe(self, name, seconds, labels):
+        self.write({"type": "timer", "name": name, "seconds": seconds,
+                    "labels": labels})
+
+    def write(self, event):
+        event["time"] = time.time()
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.stream.write(line + "\n")
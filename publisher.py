@@ -1,4 +1,8 @@
-from web3 import Web3
+from transport import Transport, Rejected
+import metrics as _metrics
+import schema
+import threading
+import time
 import json
 
 
@@ -9,14 +13,48 @@ class Publisher():
     to save space on chain. The idea is to keep the signal string shorter than
     an IPFS hash, as that is the next step up in terms of on-chain storage."""
 
-    def __init__(self, endpoint, pub_k, pvt_k, data):
+    def __init__(self, endpoint, pub_k, pvt_k, data, transport=None,
+                 metrics=None):
         self.pub_k = pub_k
         self.pvt_k = pvt_k
         self.endpoint = endpoint
         self.data = data
 
-        # Connect to ETH node.
-        self.w3 = Web3(Web3.HTTPProvider(self.endpoint))
+        # Timings and counters; disabled unless a metrics.Metrics is given.
+        self.metrics = metrics if metrics is not None else _metrics.NULL
+
+        # Lookup tables for encoding signals with the latest schema version,
+        # compiled once from data (a schema.Registry or data.json document).
+        self.codec = schema.registry(self.data)
+
+        # ETH node connection, opened on first use of self.w3 so importing
+        # and constructing this class doesn't pull in web3.
+        self._w3 = None
+
+        # Pooled session for batched JSON-RPC calls to the node, also used to
+        # retry web3 reads. Our own node has no quota to respect, so calls
+        # are not throttled.
+        self.transport = (
+            transport if transport is not None
+            else Transport(rate=None, metrics=self.metrics))
+
+        # Signals waiting for flush(), the next nonce to assign (fetched from
+        # the node on first use) and sent tx hashes mapped to their nonce.
+        self.queue = []
+        self.nonce = None
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @property
+    def w3(self):
+        """Web3 connection to the ETH node."""
+
+        if self._w3 is None:
+            from web3 import Web3
+            self._w3 = Web3(Web3.HTTPProvider(
+                self.endpoint,
+                request_kwargs={"timeout": self.transport.timeout}))
+        return self._w3
 
     def publish(self, signal_string):
         """ Create a transaction containing an encoded signal string in the
@@ -29,18 +67,169 @@ class Publisher():
         transact, only that the transaction originates from our address for the
         sake of proving the signals are ours."""
 
-        # Create transaction
-        signed_txn = self.w3.eth.account.signTransaction(dict(
-            nonce=self.w3.eth.getTransactionCount(self.pub_k),
-            gasPrice=self.w3.eth.gasPrice,
+        with self.lock:
+            nonce = self.next_nonce()
+            signed_txn = self.sign(signal_string, nonce, self.rpc(
+                "eth_gasPrice", lambda: self.w3.eth.gasPrice))
+
+        # Execute transaction
+        try:
+            txhash = self.rpc(
+                "eth_sendRawTransaction", self.w3.eth.sendRawTransaction,
+                signed_txn.rawTransaction).hex()
+        except Exception:
+            # Resync the nonce from the node on the next send.
+            with self.lock:
+                self.nonce = None
+            raise
+        self.pending[txhash] = nonce
+        return txhash
+
+    def enqueue(self, signal_string):
+        """Queue an encoded signal string to be published by flush()."""
+
+        with self.lock:
+            self.queue.append(signal_string)
+
+    def flush(self):
+        """ Publish all queued signals and return their tx hashes, in queue
+        order.
+
+        The gas price is fetched once for the whole queue and nonces are
+        assigned locally in sequence, so a burst of signals costs two node
+        round trips for setup (one on later flushes) plus a single JSON-RPC
+        batch call to submit, and signals sent back to back can't collide on
+        a nonce."""
+
+        with self.lock:
+            queue, self.queue = self.queue, []
+            if not queue:
+                return []
+            gas_price = self.rpc(
+                "eth_gasPrice", lambda: self.w3.eth.gasPrice)
+            signed = []
+            for i in queue:
+                nonce = self.next_nonce()
+                signed.append((nonce, self.sign(i, nonce, gas_price)))
+
+        return self.send_batch(signed, queue)
+
+    def sign(self, signal_string, nonce, gas_price):
+        """Return a signed signal transaction with the given nonce and gas
+        price. See publish() for the transaction layout."""
+
+        return self.w3.eth.account.signTransaction(dict(
+            nonce=nonce,
+            gasPrice=gas_price,
             gas=100000,
             to=self.pub_k,
             value=5,  # tiny tx value
             data=signal_string),
             self.pvt_k)
 
-        # Execute transaction
-        return self.w3.eth.sendRawTransaction(signed_txn.rawTransaction).hex()
+    def next_nonce(self):
+        """Return the next nonce to use and advance the local counter. The
+        counter starts from the node's pending transaction count. Caller must
+        hold self.lock."""
+
+        if self.nonce is None:
+            self.nonce = self.rpc(
+                "eth_getTransactionCount", self.w3.eth.getTransactionCount,
+                self.pub_k, 'pending')
+        nonce = self.nonce
+        self.nonce += 1
+        return nonce
+
+    def send_batch(self, signed: list, signals: list = None):
+        """ Submit (nonce, signed transaction) pairs to the node in one
+        JSON-RPC batch call and return their tx hashes. If the provider
+        doesn't support batching (it replies with something other than a
+        list, or refuses the batch with an HTTP 4xx status), fall back to
+        sending them one at a time.
+
+        The batch call goes through the transport, so it is retried if the
+        node times out or errors. Resending a signed transaction is harmless:
+        the node reports it as already known, which counts as sent.
+
+        Sent transactions are recorded in self.pending. If any are rejected
+        the local nonce is resynced from the node and an exception raised
+        listing the errors. If the batch can't be submitted at all, the
+        nonce is resynced, signals (the signal strings signed, if given) are
+        put back on the front of the queue and the error re-raised."""
+
+        batch = [
+            {"jsonrpc": "2.0", "id": i, "method": "eth_sendRawTransaction",
+             "params": [tx.rawTransaction.hex()]}
+            for i, (nonce, tx) in enumerate(signed)]
+        try:
+            response = self.transport.post(self.endpoint, json=batch)
+        except Rejected:
+            # Some providers refuse batches with an HTTP 4xx status.
+            response = None
+        except Exception:
+            with self.lock:
+                self.nonce = None
+                if signals:
+                    self.queue[:0] = signals
+            raise
+
+        if isinstance(response, list):
+            results = {r.get('id'): r for r in response}
+        else:
+            # Provider rejected the batch; submit sequentially instead.
+            results = {}
+            for i, (nonce, tx) in enumerate(signed):
+                try:
+                    results[i] = {"result": self.rpc(
+                        "eth_sendRawTransaction",
+                        self.w3.eth.sendRawTransaction,
+                        tx.rawTransaction).hex()}
+                except Exception as e:
+                    results[i] = {"error": str(e)}
+
+        hashes, errors = [], []
+        for i, (nonce, tx) in enumerate(signed):
+            r = results.get(i, {"error": "no response"})
+            error = str(r.get('error')).lower()
+            if "result" not in r and (
+                    "already known" in error or "known transaction" in error):
+                # Already in the node's pool from an earlier attempt.
+                r = {"result": tx.hash.hex()}
+            if "result" in r:
+                hashes.append(r['result'])
+                self.pending[r['result']] = nonce
+            else:
+                hashes.append(None)
+                errors.append((nonce, r.get('error')))
+
+        if errors:
+            with self.lock:
+                self.nonce = None
+            raise Exception("Failed to publish signals:", errors, hashes)
+        return hashes
+
+    def reconcile(self):
+        """Drop mined transactions from self.pending, using the node's
+        latest transaction count, and return the hashes still pending."""
+
+        mined = self.rpc(
+            "eth_getTransactionCount", self.w3.eth.getTransactionCount,
+            self.pub_k, 'latest')
+        for txhash, nonce in list(self.pending.items()):
+            if nonce < mined:
+                del self.pending[txhash]
+        return list(self.pending)
+
+    def rpc(self, method, call, *args):
+        """Return call(*args), a web3 node call, timed and counted as
+        method. Reads are retried on connection errors and timeouts; sends
+        are not, so a failed send resyncs the nonce instead."""
+
+        self.metrics.count("rpc_calls", method=method)
+        with self.metrics.span("rpc", method=method):
+            if method == "eth_sendRawTransaction":
+                return call(*args)
+            return self.transport.call(call, *args)
 
     def encode(self, params: list):
         """ Return an encoded byte string ready to publish, given a list of
@@ -50,35 +239,38 @@ class Publisher():
         Prefix signal bytestring payloads with "SAE" (Signal Auditor Ethereum)
         as a header as to filter signals from regular transactions easily."""
 
-        signal = "SAE"
-
-        # Check that each signal string param matches an entry in json.data.
-        count = 0
-        for i in self.data['data']:
-            # If theres a match, append the dicts key to the signal string.
-            # The keys of each dict are what will form the encoded signal.
-            if params[count] in self.data['data'][i][self.key_from_value(
-                    self.data['data'][i], params[count])]:
-                signal = signal + self.key_from_value(
-                    self.data['data'][i],
-                    params[count])
-            else:
-                raise Exception("Signal parameter mis-match. Ensure input" +
-                                "strings match each field in data.json.")
-            count += 1
+        return self.codec.encode(params)
 
-        # convert to bytes
-        signal = bytes(signal, 'utf-8')
+    def encode_batch(self, signals: list):
+        """Return a list of encoded byte strings, given a list of signal
+        parameter string lists. See encode()."""
 
-        return(signal)
+        return self.codec.encode_batch(signals)
 
-    def key_from_value(self, data_dict, val):
-        """Return the key where val matches a value from the given dict."""
+    def pack(self, signals: list, timestamps: list = None):
+        """ Return a list of batch payloads packing the given encoded signals,
+        as many per payload as fit (see Codec.pack). timestamps are the unix
+        times each signal was generated, stored as offsets back from now.
+        They are only claims: the Auditor stamps every signal with the
+        publishing tx's time, which the publisher can't backdate."""
 
-        key = None
-        try:
-            key = list(data_dict.keys())[list(data_dict.values()).index(val)]
-        except ValueError as e:
-            raise Exception("Signal parameter mis-match. Ensure input",
-                            "strings match each field in data.json", e)
-        return key
+        if timestamps is None:
+            offsets = [0] * len(signals)
+        else:
+            now = time.time()
+            offsets = [now - t for t in timestamps]
+
+        size = self.codec.BATCH_MAX
+        return [
+            self.codec.pack(signals[i:i + size], offsets[i:i + size])
+            for i in range(0, len(signals), size)]
+
+    def publish_batch(self, signals: list, timestamps: list = None):
+        """Pack the given encoded signals into as few transactions as
+        possible, publish them and return the tx hashes. One transaction
+        carries up to 255 signals, so bursts of signals share the base gas
+        cost and node round trips of a single publish."""
+
+        for payload in self.pack(signals, timestamps):
+            self.enqueue(payload)
+        return self.flush()
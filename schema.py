@@ -0,0 +1,324 @@
+from collections import namedtuple
+from codec import Codec
+import threading
+import string
+import json
+import time
+import os
+
+
+class SchemaError(ValueError):
+    """The signal schema file is invalid. A ValueError, so callers reading
+    signals treat a bad schema file like any other unreadable signal."""
+
+
+class UnknownVersion(ValueError):
+    """A signal names a schema version that isn't in the schema file."""
+
+
+# A compiled schema: the parsed document, {version: Codec} and the latest
+# version's Codec. Replaced whole on reload, never modified.
+Tables = namedtuple("Tables", "document codecs latest")
+
+
+def reject_duplicates(pairs):
+    """json object_pairs_hook raising SchemaError on duplicate keys, which
+    json.load would otherwise silently resolve to the last value."""
+
+    result = {}
+    for key, value in pairs:
+        if key in result:
+            raise SchemaError("Duplicate key " + repr(key) + " in schema.")
+        result[key] = value
+    return result
+
+
+def registry(data):
+    """Return data as a Registry, given a Registry, a schema file path or a
+    parsed schema document."""
+
+    return data if isinstance(data, Registry) else Registry(data)
+
+
+class Registry():
+    """ Registry holds every version of the signal vocabulary, compiled once
+    into a Codec per version, and routes each signal to the codec of the
+    version it was published with.
+
+    The schema file (data.json) lists versions in order, each adding fields
+    or codes to the one before:
+
+        {"versions": [
+            {"version": 0, "data": {"instrument": {"A": "EURUSD", ...}, ...}},
+            {"version": 1, "data": {"trigger": {"H": "1 min close"}}}]}
+
+    Versions can only add: a code keeps the label it was given, so signals
+    published under an old version still decode the same way. The file is
+    validated on load: duplicate keys, codes that aren't a single capital
+    letter, labels used twice in a field and redefined codes are rejected
+    with SchemaError. A plain {"data": {...}} document is read as a single
+    version 0.
+
+    New signals are encoded with the latest version. Decoded rows always
+    follow the latest version's fields, with None for fields the signal's
+    version didn't have yet. Registry has the same encode/decode/pack/unpack
+    interface as Codec, so it can be used wherever one is.
+
+    If loaded from a file, the file is re-read when it has changed, checked
+    at most every `interval` seconds and whenever a signal names a version
+    we don't know yet, so a vocabulary update needs no restart. Signals
+    of a version the file doesn't have (yet) raise UnknownVersion."""
+
+    HEADER = Codec.HEADER
+    BATCH_MAX = Codec.BATCH_MAX
+
+    def __init__(self, source, interval: float = 5):
+        self.path = source if isinstance(source, str) else None
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.checked = time.monotonic()
+        if self.path is None:
+            self.compile(source)
+        else:
+            self.load()
+
+    def load(self):
+        """Read and compile the schema file."""
+
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path) as file:
+            document = json.load(file, object_pairs_hook=reject_duplicates)
+        self.compile(document)
+        self.mtime = mtime
+
+    def reload(self, force: bool = False):
+        """Re-read the schema file if it has changed since it was loaded.
+        Return True if it was reloaded. An invalid file raises SchemaError
+        and leaves the loaded versions in place."""
+
+        if self.path is None:
+            return False
+        with self.lock:
+            self.checked = time.monotonic()
+            if not force and os.stat(self.path).st_mtime == self.mtime:
+                return False
+            self.load()
+            return True
+
+    def check(self):
+        """Reload the schema file if interval seconds have passed since it
+        was last checked."""
+
+        if self.path is not None and \
+                time.monotonic() - self.checked >= self.interval:
+            self.reload()
+
+    def compile(self, document):
+        """Validate a parsed schema document and compile a Codec for each of
+        its versions."""
+
+        if "versions" not in document:
+            document = {"versions": [{"version": 0, "data": document['data']}]}
+
+        codecs = {}
+        fields = {}
+        for i, entry in enumerate(document['versions']):
+            version = entry.get('version')
+            if version != i:
+                raise SchemaError("Schema versions must count up from 0; " +
+                                  "expected " + str(i) + ".")
+            if version > 0xFF:
+                raise SchemaError("Too many schema versions.")
+
+            # Each version builds on a copy of the one before.
+            fields = {f: dict(values) for f, values in fields.items()}
+            for f, values in entry['data'].items():
+                table = fields.setdefault(f, {})
+                for code, label in values.items():
+                    if len(code) != 1 or code not in string.ascii_uppercase:
+                        raise SchemaError(
+                            "Invalid code " + repr(code) + " in field " + f +
+                            "; codes are single capital letters.")
+                    if code in table and table[code] != label:
+                        raise SchemaError(
+                            "Version " + str(version) + " redefines code " +
+                            code + " of field " + f + ".")
+                    if code not in table and label in table.values():
+                        raise SchemaError(
+                            "Label " + repr(label) + " appears twice in " +
+                            "field " + f + ".")
+                    table[code] = label
+            codecs[version] = Codec({"data": fields}, version)
+
+        if not codecs:
+            raise SchemaError("Schema has no versions.")
+
+        # Swap in the new tables all at once; readers never see a mix.
+        self.tables = Tables(document, codecs, codecs[len(codecs) - 1])
+
+    @property
+    def document(self):
+        """The parsed schema document."""
+
+        return self.tables.document
+
+    @property
+    def codecs(self):
+        """{version: Codec} for every known version."""
+
+        return self.tables.codecs
+
+    @property
+    def latest(self):
+        """The Codec of the latest version."""
+
+        return self.tables.latest
+
+    @property
+    def version(self):
+        """The latest schema version, used for new signals."""
+
+        return self.latest.version
+
+    @property
+    def fields(self):
+        """Field names of the latest version."""
+
+        return self.latest.fields
+
+    @property
+    def vocabulary(self):
+        """{field: {code: label}} of the latest version."""
+
+        return dict(zip(self.latest.fields, self.latest.reverse))
+
+    @property
+    def data(self):
+        """The latest vocabulary in the old data.json {"data": ...} form."""
+
+        return {"data": self.vocabulary}
+
+    def codec(self, version: int):
+        """Return the Codec for version, re-reading the schema file once if
+        it's unknown. Raise UnknownVersion if there's no such version."""
+
+        codec = self.codecs.get(version)
+        if codec is None:
+            try:
+                self.reload()
+            except SchemaError:
+                # Keep the loaded versions; retried on the next unknown one.
+                pass
+            codec = self.codecs.get(version)
+            if codec is None:
+                raise UnknownVersion(
+                    "Unknown schema version " + str(version) + ".")
+        return codec
+
+    def parse(self, signal: str):
+        """Return the Codec for an encoded signal string's version."""
+
+        end = len(self.HEADER)
+        while end < len(signal) and signal[end].isdigit():
+            end += 1
+        if end == len(self.HEADER):
+            return self.codec(0)
+        return self.codec(int(signal[len(self.HEADER):end]))
+
+    def unknown(self, data: bytes):
+        """ Return True if data, a signal or batch payload or at least its
+        first 8 bytes, is well-formed up to a schema version number that we
+        don't know, even after re-reading the schema file. Such signals
+        can't be checked or decoded until the schema file catches up."""
+
+        header = self.HEADER.encode()
+        if not data.startswith(header):
+            return False
+        rest = data[len(header):]
+        if rest[:1] == bytes([Codec.VERSIONED_BATCH_VERSION]):
+            if len(rest) < 2:
+                return False
+            version = rest[1]
+        else:
+            digits = len(rest) - len(rest.lstrip(string.digits.encode()))
+            if not digits:
+                return False
+            version = int(rest[:digits])
+        if version > 0xFF:
+            return False
+        try:
+            self.codec(version)
+        except UnknownVersion:
+            return True
+        return False
+
+    def matches(self, signal: str):
+        """Return True if signal is a well-formed signal of its version: the
+        right length, with a known code for every field."""
+
+        try:
+            return self.parse(signal).matches(signal)
+        except ValueError:
+            return False
+
+    def encode(self, params: list):
+        """Encode a signal with the latest version. See Codec.encode."""
+
+        self.check()
+        return self.latest.encode(params)
+
+    def encode_batch(self, signals: list):
+        """Encode a list of signals with the latest version."""
+
+        self.check()
+        return self.latest.encode_batch(signals)
+
+    def decode(self, signal: str, latest=None):
+        """Return the parameter strings of an encoded signal of any version,
+        in the field order of latest (default the latest version's Codec).
+        Raise KeyError if the signal contains an unknown code."""
+
+        if latest is None:
+            latest = self.latest
+        codec = self.parse(signal)
+        row = codec.decode(signal)
+        if codec.fields == latest.fields:
+            return row
+        values = dict(zip(codec.fields, row))
+        return [values.get(f) for f in latest.fields]
+
+    def decode_batch(self, signals: list, columnar: bool = False):
+        """As Codec.decode_batch, for signals of any version."""
+
+        # One version's fields for every row, even if the file is reloaded.
+        latest = self.latest
+        rows = [self.decode(s, latest) for s in signals]
+        if not columnar:
+            return rows
+        fields = latest.fields
+        return {f: list(col) for f, col in zip(
+            fields, zip(*rows) if rows else [()] * len(fields))}
+
+    def pack(self, signals: list, offsets: list = None):
+        """Pack encoded signals, all of one version, into a batch payload.
+        See Codec.pack."""
+
+        versions = {self.parse(s if isinstance(s, str) else s.decode())
+                    for s in signals}
+        if len(versions) > 1:
+            raise Exception("Can't pack signals of different schema " +
+                            "versions into one batch payload.")
+        codec = versions.pop() if versions else self.latest
+        return codec.pack(signals, offsets)
+
+    def unpack(self, payload: bytes):
+        """Unpack a batch payload of any version. See Codec.unpack."""
+
+        if payload[:len(Codec.VERSIONED_BATCH_HEADER)] == \
+                Codec.VERSIONED_BATCH_HEADER:
+            if len(payload) <= len(Codec.VERSIONED_BATCH_HEADER):
+                raise ValueError("Batch signal payload length mismatch.")
+            return self.codec(
+                payload[len(Codec.VERSIONED_BATCH_HEADER)]).unpack(payload)
+        return self.codec(0).unpack(payload)
@@ -0,0 +1,230 @@
+import schema
+import numpy as np
+import os
+import re
+
+
+class Prices():
+    """ Prices loads local OHLCV files, one CSV per instrument named after
+    the data.json instrument label (e.g. BTCUSD.csv), with a header row and
+    columns timestamp (unix seconds, bar open time), open, high, low, close
+    and volume, in ascending time order.
+
+    Range-min/max lookup tables over lows and highs are built once per
+    instrument, so the worst price over any window is an O(1) lookup."""
+
+    def __init__(self, path):
+        self.path = path
+        self.cache = {}
+
+    def get(self, instrument):
+        """Return (times, close, low_table, high_table) for instrument, or
+        None if there is no price file for it."""
+
+        if instrument not in self.cache:
+            file = os.path.join(self.path, instrument + ".csv")
+            if not os.path.exists(file):
+                self.cache[instrument] = None
+            else:
+                bars = np.loadtxt(file, delimiter=",", skiprows=1, ndmin=2)
+                self.cache[instrument] = (
+                    bars[:, 0].astype(np.int64), bars[:, 4],
+                    self.table(bars[:, 3], np.minimum),
+                    self.table(bars[:, 2], np.maximum))
+        return self.cache[instrument]
+
+    @staticmethod
+    def table(values, op):
+        """Return a sparse table where row k holds op over each window of
+        2^k values starting at that index."""
+
+        rows = [values]
+        span = 1
+        while span * 2 <= len(values):
+            prev = rows[-1]
+            rows.append(op(prev[:-span], prev[span:len(prev)]))
+            span *= 2
+        # Pad rows to a rectangle; padding is never read by query().
+        table = np.full((len(rows), len(values)), np.nan)
+        for k, row in enumerate(rows):
+            table[k, :len(row)] = row
+        return table
+
+    @staticmethod
+    def query(table, op, start, end):
+        """Return op over values[start:end + 1] for arrays of inclusive
+        index ranges, using a table from table()."""
+
+        k = np.floor(np.log2(end - start + 1)).astype(np.int64)
+        return op(table[k, start], table[k, end - (1 << k) + 1])
+
+
+class Scorer():
+    """ Scorer evaluates how published signals actually played out against
+    local price history, and ranks publishers by their outcomes.
+
+    Each signal is entered at the close of the first bar at or after its
+    timestamp plus its trigger period ("Immediate" enters straight away, "1
+    hour close" an hour later), whatever its order type. It is then scored at
+    each horizon (seconds after entry) by its return in the signal's
+    direction, and by its drawdown: the worst adverse move from entry within
+    the longest horizon. All signals for an instrument are evaluated at once
+    with NumPy rather than bar by bar."""
+
+    # Sign of a position in each direction label.
+    DIRECTIONS = {"Long": 1, "Short": -1}
+
+    UNITS = {"min": 60, "hour": 3600, "day": 86400}
+
+    def __init__(self, data, prices, horizons=None):
+        self.codec = schema.registry(data)
+        self.prices = prices if isinstance(prices, Prices) else Prices(prices)
+
+        # Trigger periods in seconds, by trigger label.
+        self.triggers = {
+            label: self.seconds(label)
+            for label in self.codec.vocabulary['trigger'].values()}
+
+        # Score at each distinct trigger period by default.
+        if horizons is None:
+            horizons = sorted({s for s in self.triggers.values() if s})
+        self.horizons = np.array(horizons, dtype=np.int64)
+
+    def seconds(self, trigger):
+        """Return the period of a trigger label like "4 hour close" in
+        seconds, or 0 for triggers without one ("Immediate")."""
+
+        match = re.match(r"(\d+) (min|hour|day)", trigger)
+        return int(match[1]) * self.UNITS[match[2]] if match else 0
+
+    def score(self, signals: dict):
+        """ Score signals given as {address: scrape() result} and return a
+        dict of per-signal columns, each a NumPy array in input order:
+        address, timestamp, instrument, direction, entry (price; NaN if
+        there's no price data), returns (signals x horizons) and drawdown.
+        Unscoreable signals have NaN outcomes."""
+
+        addresses, timestamps, payloads = [], [], []
+        for address, sigs in signals.items():
+            for sig in sigs or []:
+                for timestamp, payload in sig.items():
+                    addresses.append(address)
+                    timestamps.append(int(timestamp))
+                    payloads.append(payload)
+
+        n = len(payloads)
+        cols = self.codec.decode_batch(payloads, columnar=True)
+        instrument = np.array(cols['instrument'], dtype=object)
+        direction = np.array(
+            [self.DIRECTIONS.get(d, 0) for d in cols['direction']],
+            dtype=np.int8)
+        start = np.array(timestamps, dtype=np.int64) + np.array(
+            [self.triggers.get(t, 0) for t in cols['trigger']],
+            dtype=np.int64)
+
+        entry = np.full(n, np.nan)
+        returns = np.full((n, len(self.horizons)), np.nan)
+        drawdown = np.full(n, np.nan)
+
+        for inst in set(cols['instrument']):
+            prices = self.prices.get(inst)
+            if prices is None:
+                continue
+            times, close, lows, highs = prices
+            rows = np.flatnonzero((instrument == inst) & (direction != 0))
+
+            # Entry bar; signals after the last bar can't be scored.
+            i = np.searchsorted(times, start[rows], side="left")
+            ok = i < len(times)
+            rows, i = rows[ok], i[ok]
+            if not len(rows):
+                continue
+            side = direction[rows]
+            entry[rows] = close[i]
+
+            # Exit bar at each horizon: the last bar opening at or before it,
+            # and only if the price history reaches that far.
+            end = times[i][:, None] + self.horizons[None, :]
+            j = np.searchsorted(times, end, side="right") - 1
+            reached = end <= times[-1]
+            ret = side[:, None] * (close[j] / close[i][:, None] - 1)
+            returns[rows] = np.where(reached, ret, np.nan)
+
+            # Worst low (long) or high (short) after entry up to the last
+            # exit. The entry bar's own range came before its close, so the
+            # search starts at the next bar; with no later bar it's 0.
+            last = j[:, -1]
+            after = np.minimum(i + 1, last)
+            low = Prices.query(lows, np.minimum, after, last)
+            high = Prices.query(highs, np.maximum, after, last)
+            drawdown[rows] = np.where(last > i, np.minimum(0, np.where(
+                side > 0, low / close[i] - 1, 1 - high / close[i])), 0)
+
+        return {
+            "address": np.array(addresses, dtype=object),
+            "timestamp": np.array(timestamps, dtype=np.int64),
+            "instrument": instrument,
+            "direction": direction,
+            "entry": entry,
+            "returns": returns,
+            "drawdown": drawdown}
+
+    def rank(self, scored: dict, horizon: int = -1, roots=None):
+        """ Return per-publisher outcomes from a score() result as a list of
+        dicts, best first by mean return at the given horizon index: address,
+        signals (total), scored (with price data), and per horizon hit_rate
+        and mean_return, plus mean and worst drawdown.
+
+        Given the publishers' Merkle roots (Auditor.roots() or Index.roots()
+        dicts), each result also counts the committed signals the publisher
+        has withheld, which its outcomes can't account for; otherwise
+        withheld is None."""
+
+        addresses, group = np.unique(scored["address"], return_inverse=True)
+        count = len(addresses)
+        returns = scored["returns"]
+        valid = ~np.isnan(returns)
+
+        def mean(values, mask):
+            total = np.bincount(
+                group, weights=np.where(mask, values, 0), minlength=count)
+            seen = np.bincount(group, weights=mask, minlength=count)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return total / seen
+
+        hits = np.stack([
+            mean(returns[:, h] > 0, valid[:, h])
+            for h in range(len(self.horizons))], axis=1)
+        means = np.stack([
+            mean(returns[:, h], valid[:, h])
+            for h in range(len(self.horizons))], axis=1)
+
+        withheld = {}
+        for r in roots or []:
+            if r["committed"] is not None and r["proven"] < r["committed"]:
+                withheld[r["address"]] = withheld.get(r["address"], 0) + \
+                    r["committed"] - r["proven"]
+
+        totals = np.bincount(group, minlength=count)
+        dd = scored["drawdown"]
+        dd_valid = ~np.isnan(dd)
+        scoreable = np.bincount(group, weights=dd_valid, minlength=count)
+        dd_mean = mean(dd, dd_valid)
+        dd_worst = np.full(count, np.nan)
+        np.fmin.at(dd_worst, group[dd_valid], dd[dd_valid])
+
+        result = [{
+            "address": addresses[a],
+            "signals": int(totals[a]),
+            "scored": int(scoreable[a]),
+            "hit_rate": dict(zip(self.horizons.tolist(), hits[a].tolist())),
+            "mean_return": dict(zip(
+                self.horizons.tolist(), means[a].tolist())),
+            "mean_drawdown": float(dd_mean[a]),
+            "max_drawdown": float(dd_worst[a]),
+            "withheld": None if roots is None else withheld.get(
+                addresses[a].lower(), 0)} for a in range(count)]
+
+        key = means[:, horizon]
+        order = np.argsort(np.where(np.isnan(key), -np.inf, key))[::-1]
+        return [result[a] for a in order]
@@ -0,0 +1,215 @@
+from merkle import Commitment
+import sqlite3
+import threading
+
+
+class Store():
+    """ Store persists scraped signals and a per-address checkpoint (the
+    highest block already scanned) in a local SQLite database, so repeat
+    audits of an address only need to fetch blocks after the checkpoint.
+
+    A single connection is shared between threads, serialized by a lock."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            address TEXT PRIMARY KEY,
+            block INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS signals (
+            address TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            block INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            signal TEXT NOT NULL,
+            PRIMARY KEY (hash, timestamp, signal));
+        CREATE INDEX IF NOT EXISTS signals_address
+            ON signals (address, timestamp);
+        CREATE TABLE IF NOT EXISTS commitments (
+            address TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            block INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            root TEXT NOT NULL,
+            count INTEGER,
+            PRIMARY KEY (address, root));
+        CREATE TABLE IF NOT EXISTS proven (
+            address TEXT NOT NULL,
+            root TEXT NOT NULL,
+            leaf TEXT NOT NULL,
+            PRIMARY KEY (address, root, leaf));
+        CREATE TABLE IF NOT EXISTS unknown (
+            address TEXT NOT NULL,
+            hash TEXT PRIMARY KEY,
+            block INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            input TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS unknown_address ON unknown (address);"""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            self.db.executescript(self.SCHEMA)
+            # Stores from before signal counts were kept; their count is
+            # unknown (NULL).
+            columns = {row[1] for row in self.db.execute(
+                "PRAGMA table_info(commitments)")}
+            if "count" not in columns:
+                self.db.execute(
+                    "ALTER TABLE commitments ADD COLUMN count INTEGER")
+        self.lock = threading.Lock()
+
+    def checkpoint(self, address):
+        """Return the last scanned block for address, or None if the address
+        has never been scanned."""
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT block FROM checkpoints WHERE address = ?",
+                (address.lower(),)).fetchone()
+        return row[0] if row else None
+
+    def merge(self, address, signals: list, block, commitments: list = (),
+              unknown: list = ()):
+        """Insert the given signal records and merkle.Commitment records for
+        address and advance its checkpoint to block, in a single transaction.
+        Records already in the store are ignored, so overlapping scans are
+        harmless.
+
+        unknown are etherscan-style transaction dicts whose signals are in
+        a schema version we can't read yet, kept to be read later (see
+        unknown() and resolve())."""
+
+        address = address.lower()
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO signals VALUES (?, ?, ?, ?, ?)",
+                [(address, s.hash, s.block, s.timestamp, s.payload)
+                    for s in signals])
+            self.db.executemany(
+                "INSERT OR IGNORE INTO commitments VALUES (?, ?, ?, ?, ?, ?)",
+                [(address, c.hash, c.block, c.timestamp, c.root, c.count)
+                    for c in commitments])
+            self.db.executemany(
+                "INSERT OR IGNORE INTO unknown VALUES (?, ?, ?, ?, ?)",
+                [(address, tx['hash'], int(tx['blockNumber']),
+                  int(tx['timeStamp']), tx['input']) for tx in unknown])
+            if block is not None:
+                self.db.execute(
+                    "INSERT INTO checkpoints VALUES (?, ?) ON CONFLICT " +
+                    "(address) DO UPDATE SET block = MAX(block, excluded.block)",  # noqa
+                    (address, block))
+
+    def unknown(self, address):
+        """Return the transactions kept by merge() for address as
+        etherscan-style dicts, oldest first."""
+
+        address = address.lower()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT hash, block, timestamp, input FROM unknown WHERE " +
+                "address = ? ORDER BY block", (address,)).fetchall()
+        return [
+            {"hash": h, "blockNumber": str(b), "timeStamp": str(t),
+             "from": address, "input": i} for h, b, t, i in rows]
+
+    def resolve(self, address, signals: list, hashes: list):
+        """Insert signal records read from kept transactions and forget
+        those transactions (by tx hash), in a single transaction."""
+
+        address = address.lower()
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO signals VALUES (?, ?, ?, ?, ?)",
+                [(address, s.hash, s.block, s.timestamp, s.payload)
+                    for s in signals])
+            self.db.executemany(
+                "DELETE FROM unknown WHERE hash = ?", [(h,) for h in hashes])
+
+    def commitment(self, address, root):
+        """Return the merkle.Commitment of root (hex) published by address,
+        or None if none has been scraped. If it was published more than
+        once, the earliest counts."""
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT address, hash, block, timestamp, root, count FROM " +
+                "commitments WHERE address = ? AND root = ?",
+                (address.lower(), root.lower())).fetchone()
+        return Commitment(*row) if row else None
+
+    def prove(self, address, signal, root, leaf):
+        """Insert a signal record proven under root (hex) and record its
+        leaf hash (hex) as revealed, in a single transaction."""
+
+        address = address.lower()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO signals VALUES (?, ?, ?, ?, ?)",
+                (address, signal.hash, signal.block, signal.timestamp,
+                 signal.payload))
+            self.db.execute(
+                "INSERT OR IGNORE INTO proven VALUES (?, ?, ?)",
+                (address, root.lower(), leaf.lower()))
+
+    def roots(self, address=None):
+        """ Return the roots published by address (or every address) as
+        dicts of address, root, hash, block, timestamp, committed (the
+        signal count in the commitment; None for roots scraped before counts
+        were kept) and proven (distinct leaves revealed so far), oldest
+        first. A root with fewer proven than committed has withheld
+        signals."""
+
+        query = "SELECT c.address, c.root, c.hash, c.block, c.timestamp, " + \
+            "c.count, COUNT(p.leaf) FROM commitments c LEFT JOIN proven p " + \
+            "ON p.address = c.address AND p.root = c.root"
+        params = ()
+        if address is not None:
+            query += " WHERE c.address = ?"
+            params = (address.lower(),)
+        with self.lock:
+            rows = self.db.execute(
+                query + " GROUP BY c.address, c.root ORDER BY c.timestamp",
+                params).fetchall()
+        names = ("address", "root", "hash", "block", "timestamp",
+                 "committed", "proven")
+        return [dict(zip(names, row)) for row in rows]
+
+    def leaves(self, address=None):
+        """Return (address, root, leaf) for every proven leaf of address (or
+        every address)."""
+
+        query = "SELECT address, root, leaf FROM proven"
+        params = ()
+        if address is not None:
+            query += " WHERE address = ?"
+            params = (address.lower(),)
+        with self.lock:
+            return self.db.execute(query, params).fetchall()
+
+    def signals(self, address):
+        """Return all stored signals for address as a list of
+        {timestamp: signal} dicts, oldest first."""
+
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT timestamp, signal FROM signals WHERE address = ? " +
+                "ORDER BY timestamp, block, hash", (address.lower(),))
+            return [{str(t): s} for t, s in rows]
+
+    def records(self, address=None):
+        """Yield stored (address, hash, block, timestamp, signal) tuples, in
+        Signal field order, for address or for every address, oldest first.
+        Rows are fetched in batches rather than all at once."""
+
+        query = "SELECT address, hash, block, timestamp, signal FROM signals"
+        params = ()
+        if address is not None:
+            query += " WHERE address = ?"
+            params = (address.lower(),)
+        with self.lock:
+            cursor = self.db.execute(query + " ORDER BY timestamp", params)
+            rows = cursor.fetchmany(10000)
+        while rows:
+            yield from rows
+            with self.lock:
+                rows = cursor.fetchmany(10000)
@@ -0,0 +1,312 @@
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+import metrics as _metrics
+import requests
+import threading
+import random
+import time
+
+
+class TransportError(Exception):
+    """A request failed for good: retries ran out, or the response was an
+    error that retrying won't fix."""
+
+
+class Retryable(TransportError):
+    """A failed request worth retrying, e.g. a timeout or rate limit."""
+
+
+class Rejected(TransportError):
+    """The server refused the request with an HTTP 4xx status (other than
+    429). `status` is the status code and `body` the decoded JSON body, or
+    None if it wasn't JSON."""
+
+    def __init__(self, status, body=None):
+        TransportError.__init__(self, "HTTP " + str(status), body)
+        self.status = status
+        self.body = body
+
+
+class RateLimiter():
+    """ Token bucket rate limiter. Allows bursts of up to `burst` calls, then
+    refills at `rate` calls per second. Safe to share between threads."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Breaker():
+    """ Circuit breaker for one host. Opens after `threshold` consecutive
+    failures, refusing calls for `cooldown` seconds, then lets a trial call
+    through; success closes it again, failure re-opens it."""
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be made now."""
+
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened >= self.cooldown:
+                # Half open: allow one trial, re-arming the cooldown.
+                self.opened = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time.monotonic()
+
+
+class Transport():
+    """ Shared HTTP layer for Auditor and Publisher. Reuses pooled keep-alive
+    connections through a single requests.Session and throttles outgoing
+    calls with a token bucket, so concurrent callers stay inside API quotas.
+
+    Etherscan's free tier allows 5 calls per second; raise `rate` to match
+    your plan, or pass rate=None to disable throttling.
+
+    Every call has a `timeout` (seconds). Timeouts, connection errors, HTTP
+    429/5xx and anything a caller's check() flags as Retryable are retried
+    up to `retries` times with exponential backoff (`backoff` doubling up to
+    `max_backoff`) and full jitter. Each host has a circuit breaker that
+    stops calling it after repeated failures.
+
+    Methods take either one URL or a list of equivalent URLs (several node
+    endpoints, or the same etherscan query with different API keys). With a
+    list, retries rotate through the URLs, and if `hedge` is set a call that
+    hasn't answered within `hedge` seconds is also sent to the next URL,
+    taking whichever response arrives first.
+
+    Reports http_wait and json_parse timings, http_calls, bytes_fetched,
+    rpc_calls, retries and hedges to `metrics`, if given."""
+
+    def __init__(self, rate: float = 5, burst: int = 5, pool: int = 16,
+                 metrics=None, timeout: float = 10, retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 8, hedge=None,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 30):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.limiter = RateLimiter(rate, burst) if rate else None
+        self.metrics = metrics if metrics is not None else _metrics.NULL
+
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.pool = pool
+
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.breakers = {}
+        self.lock = threading.Lock()
+        self.hedger = None
+
+    def get(self, url, check=None, **kwargs):
+        """GET url (or one of a list of equivalent urls), returning the
+        decoded JSON body. check(body), if given, may raise Retryable or
+        TransportError to reject a response."""
+
+        return self.request("GET", url, check, kwargs)
+
+    def post(self, url, check=None, **kwargs):
+        """POST to url (or one of a list of equivalent urls), returning the
+        decoded JSON body. See get()."""
+
+        return self.request("POST", url, check, kwargs)
+
+    def request(self, method, urls, check, kwargs):
+        """Make a call with retries, backoff and optional hedging."""
+
+        urls = [urls] if isinstance(urls, str) else list(urls)
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.metrics.count("retries", method=method)
+                time.sleep(random.uniform(0, min(
+                    self.max_backoff, self.backoff * 2 ** (attempt - 1))))
+            # Start from a different url on each attempt.
+            order = urls[attempt % len(urls):] + urls[:attempt % len(urls)]
+            try:
+                if self.hedge is not None and len(order) > 1:
+                    return self.hedged(method, order, check, kwargs)
+                return self.send(method, self.pick(order), check, kwargs)
+            except Retryable as e:
+                error = e
+        raise TransportError(
+            method + " failed after " + str(self.retries + 1) +
+            " attempts:", error)
+
+    def pick(self, urls):
+        """Return the first url whose host's breaker allows a call, or raise
+        Retryable if every breaker is open."""
+
+        for url in urls:
+            if self.breaker(url).allow():
+                return url
+        raise Retryable("Circuit open for all endpoints.")
+
+    def breaker(self, url):
+        """Return the circuit breaker for url's host."""
+
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = Breaker(
+                    self.breaker_threshold, self.breaker_cooldown)
+            return self.breakers[host]
+
+    def send(self, method, url, check, kwargs):
+        """Make a single call to url, classifying failures as Retryable or
+        TransportError."""
+
+        breaker = self.breaker(url)
+        if self.limiter:
+            self.limiter.acquire()
+        try:
+            with self.metrics.span("http_wait", method=method):
+                response = self.session.request(
+                    method, url, timeout=self.timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            breaker.failure()
+            raise Retryable(str(e))
+
+        if response.status_code == 429 or response.status_code >= 500:
+            breaker.failure()
+            raise Retryable("HTTP " + str(response.status_code))
+        breaker.success()
+        if response.status_code >= 400:
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+            raise Rejected(response.status_code, body)
+
+        try:
+            body = self.parse(response, method)
+        except ValueError as e:
+            raise Retryable("Invalid JSON response: " + str(e))
+        if check is not None:
+            check(body)
+        return body
+
+    def hedged(self, method, urls, check, kwargs):
+        """Send the call to urls[0], and to each following url in turn if
+        none has answered within self.hedge seconds or the earlier ones
+        failed. Return the first successful response."""
+
+        with self.lock:
+            if self.hedger is None:
+                self.hedger = ThreadPoolExecutor(max_workers=self.pool)
+
+        remaining = [u for u in urls if self.breaker(u).allow()]
+        if not remaining:
+            raise Retryable("Circuit open for all endpoints.")
+
+        error = None
+        inflight = set()
+        launch = True
+        while True:
+            if remaining and launch:
+                if inflight:
+                    self.metrics.count("hedges", method=method)
+                inflight.add(self.hedger.submit(
+                    self.send, method, remaining.pop(0), check, kwargs))
+            if not inflight:
+                raise error
+            done, inflight = wait(
+                inflight, timeout=self.hedge if remaining else None,
+                return_when=FIRST_COMPLETED)
+            # Hedge on timeout, or move on straight away after a failure.
+            launch = not done
+            for future in done:
+                try:
+                    return future.result()
+                except TransportError as e:
+                    error = e
+                    launch = True
+
+    def parse(self, response, method):
+        """Return the decoded JSON body of response, counting the call."""
+
+        self.metrics.count("http_calls", method=method)
+        self.metrics.count("bytes_fetched", len(response.content))
+        with self.metrics.span("json_parse"):
+            return response.json()
+
+    def call(self, fn, *args):
+        """Return fn(*args), retrying connection errors and timeouts with the
+        same backoff as HTTP calls. For node calls made through web3 rather
+        than this transport; only use it for idempotent calls."""
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.metrics.count("retries", method="call")
+                time.sleep(random.uniform(0, min(
+                    self.max_backoff, self.backoff * 2 ** (attempt - 1))))
+            try:
+                return fn(*args)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+        raise TransportError(
+            "Call failed after " + str(self.retries + 1) + " attempts:",
+            error)
+
+    def rpc_batch(self, url, calls: list):
+        """ Send (method, params) JSON-RPC calls to url (or one of a list of
+        equivalent node urls) as a single batch request and return their
+        results in call order. Raise an exception if the node returns an
+        error for any call."""
+
+        batch = [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls)]
+        for method, params in calls:
+            self.metrics.count("rpc_calls", method=method)
+        response = self.post(url, json=batch)
+        if not isinstance(response, list):
+            raise TransportError("JSON-RPC batch rejected:", response)
+
+        results = {r.get('id'): r for r in response}
+        try:
+            return [results[i]['result'] for i in range(len(calls))]
+        except KeyError:
+            errors = [results.get(i) for i in range(len(calls))
+                      if 'result' not in results.get(i, {})]
+            raise TransportError("JSON-RPC batch call failed:", errors)
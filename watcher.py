@@ -0,0 +1,173 @@
+from backends import NodeBackend
+import threading
+import logging
+import json
+
+log = logging.getLogger(__name__)
+
+
+class Watcher():
+    """ Watcher follows new blocks on our own node and pushes signals from a
+    watched set of addresses as soon as they're included, rather than
+    re-scraping whole histories.
+
+    New heads arrive through an eth_subscribe newHeads websocket subscription
+    if `ws` (a ws:// or wss:// node URL) is given, which needs the websockets
+    package; otherwise the node's block number is polled every `interval`
+    seconds. Each new block range is fetched with the node backend's batched
+    calls and only transactions sent from watched addresses with the "SAE"
+    header are decoded.
+
+    Every signal found is passed to callback(signal, decoded) and/or put on
+    queue as a (signal, decoded) tuple, where signal is an auditor Signal
+    record and decoded its Auditor.decode() row. Signals are also merged into
+    the auditor's store (and index), without moving its scan checkpoints.
+    Chain reorgs are not tracked. Point the auditor and backend at a local
+    dev chain (or pass the backend a stand-in transport) to test."""
+
+    # Longest wait, in seconds, between retries after an error.
+    MAX_BACKOFF = 60
+
+    def __init__(self, auditor, addresses, backend=None, callback=None,
+                 queue=None, ws=None, interval: float = 2):
+        self.auditor = auditor
+        self.addresses = {a.lower() for a in addresses}
+        self.backend = backend if backend is not None else NodeBackend(
+            auditor.endpoint)
+        self.callback = callback
+        self.queue = queue
+        self.ws = ws
+        self.interval = interval
+
+        # Last block processed; watching starts from the head at run().
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def watch(self, address):
+        """Add address to the watched set."""
+
+        self.addresses = self.addresses | {address.lower()}
+
+    def unwatch(self, address):
+        """Remove address from the watched set."""
+
+        self.addresses = self.addresses - {address.lower()}
+
+    def start(self):
+        """Run the watcher on a background daemon thread."""
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """Stop the watcher after the current block range."""
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """ Follow new heads until stop() is called.
+
+        Fetch errors (a node or transport failure) are logged and retried
+        after a backoff that doubles up to MAX_BACKOFF seconds, carrying on
+        from the first block not yet dispatched, so a transient failure
+        neither ends the watch nor skips blocks. A signal that fails to
+        decode or whose callback raises is logged and skipped instead, so
+        it can't hold up later blocks."""
+
+        delay = self.interval
+        while not self.stopped.is_set():
+            try:
+                heads = self.subscribe() if self.ws else self.poll()
+                for head in heads:
+                    if self.last is None:
+                        self.last = head
+                    elif head > self.last:
+                        self.process(self.last + 1, head)
+                        self.last = head
+                    delay = self.interval
+                    if self.stopped.is_set():
+                        return
+            except Exception:
+                log.exception("Watching failed after block %s; retrying "
+                              "in %ss.", self.last, delay)
+                self.stopped.wait(delay)
+                delay = min(delay * 2, self.MAX_BACKOFF)
+
+    def poll(self):
+        """Yield the node's block number every interval seconds."""
+
+        while not self.stopped.is_set():
+            yield self.backend.head()
+            self.stopped.wait(self.interval)
+
+    def subscribe(self):
+        """Yield block numbers from an eth_subscribe newHeads websocket
+        subscription."""
+
+        from websockets.sync.client import connect
+
+        with connect(self.ws) as ws:
+            ws.send(json.dumps({
+                "jsonrpc": "2.0", "id": 1, "method": "eth_subscribe",
+                "params": ["newHeads"]}))
+            json.loads(ws.recv())
+            yield self.backend.head()
+            while not self.stopped.is_set():
+                try:
+                    message = json.loads(ws.recv(timeout=self.interval))
+                except TimeoutError:
+                    continue
+                yield int(message['params']['result']['number'], 16)
+
+    def process(self, startblock, endblock):
+        """Find, decode and dispatch watched signals in the given block
+        range, returning them as a list of (signal, decoded) tuples.
+        self.last advances past each block once its signals are dispatched,
+        so a range that fails part way is retried from where it stopped."""
+
+        found = []
+        for blocks in self.backend.blocks(startblock, endblock):
+            for block in blocks:
+                for signal, decoded in self.match(block):
+                    if self.callback is not None:
+                        try:
+                            self.callback(signal, decoded)
+                        except Exception:
+                            log.exception("Callback failed for signal %s "
+                                          "in tx %s.", signal.payload,
+                                          signal.hash)
+                    if self.queue is not None:
+                        self.queue.put((signal, decoded))
+                    found.append((signal, decoded))
+                self.last = max(self.last or 0, int(block['number'], 16))
+        return found
+
+    def match(self, block):
+        """Return (signal, decoded) tuples for watched signals in block, and
+        merge them into the auditor's store. Signals that don't decode are
+        logged and left out."""
+
+        result = []
+        txs = self.backend.match(block, self.addresses)
+        for address in {tx['from'] for tx in txs}:
+            signals = self.auditor.signals(
+                [tx for tx in txs if tx['from'] == address], address)
+            if not signals:
+                continue
+            self.auditor.merge(address, signals, None)
+            for signal in signals:
+                try:
+                    decoded = self.auditor.decode(
+                        [{str(signal.timestamp): signal.payload}])[0]
+                except Exception:
+                    log.exception("Can't decode signal %s in tx %s.",
+                                  signal.payload, signal.hash)
+                    continue
+                result.append((signal, decoded))
+        return result